@@ -2,7 +2,6 @@ import asyncio
 
 from keep_alive import keep_alive
 from src.DiscordBot import DiscordBot
-from src.Migrate import migrate_tables
 
 
 async def setup():
@@ -11,7 +10,6 @@ async def setup():
 
 
 async def main():
-    # await migrate_tables()
     await setup()
 
 keep_alive()
@@ -0,0 +1,46 @@
+from collections import defaultdict
+from datetime import timezone
+from typing import Sequence
+
+import discord
+
+from src import Entities, Session
+from src.Models import MessagePayload
+from src.Repositories import DatabaseRepository
+from src.WriteBehind import WriteBehindBuffer
+
+
+class AuthorIndex:
+    """Records (author, channel, message ID, time) of every guild message in the message table
+
+    Filled from on_message through the write-behind buffer and, for older messages, by the
+    history backfill. Lets purges target exact message IDs instead of scanning channel history.
+    """
+
+    def __init__(self, writer: WriteBehindBuffer, logger) -> None:
+        self.writer = writer
+        self.logger = logger
+
+    async def record(self, message: discord.Message) -> None:
+        await self.writer.put(MessagePayload(
+            member_id=message.author.id,
+            channel_id=message.channel.id,
+            msg_id=message.id,
+            created_at=message.created_at.astimezone(timezone.utc).replace(tzinfo=None),
+        ))
+
+    async def messages_by_channel(self, member_id: int) -> dict[int, list[int]]:
+        """channel_id -> message IDs of everything the member posted, newest first like a history scan"""
+        refs: dict[int, list[int]] = defaultdict(list)
+        async for session in Session.get_db_session():
+            repo = DatabaseRepository(Entities.Message, session)
+            async for row in repo.stream(member_id=member_id):
+                refs[row.channel_id].append(row.msg_id)
+        # 件数を制限した削除で、スキャンと同じく新しいメッセージから消す
+        return {channel_id: sorted(msg_ids, reverse=True) for channel_id, msg_ids in refs.items()}
+
+    async def forget(self, msg_ids: Sequence[int]) -> None:
+        """Drop rows for deleted messages"""
+        async for session in Session.get_db_session():
+            repo = DatabaseRepository(Entities.Message, session)
+            await repo.delete_many("msg_id", list(msg_ids))
@@ -0,0 +1,44 @@
+from typing import Iterable
+
+import discord
+
+
+class ChannelIndex:
+    """Public/private classification of guild text channels, kept current from channel events
+
+    A text channel is public when it has no permission overwrites of its own.
+    """
+
+    def __init__(self) -> None:
+        self.public_ids: set[int] = set()
+        self.private_ids: set[int] = set()
+
+    def rebuild(self, channels: Iterable[discord.abc.GuildChannel]) -> None:
+        self.public_ids.clear()
+        self.private_ids.clear()
+        for channel in channels:
+            self.update(channel)
+
+    def update(self, channel: discord.abc.GuildChannel) -> None:
+        if not isinstance(channel, discord.TextChannel):
+            return
+        if channel.overwrites:
+            self.public_ids.discard(channel.id)
+            self.private_ids.add(channel.id)
+        else:
+            self.private_ids.discard(channel.id)
+            self.public_ids.add(channel.id)
+
+    def remove(self, channel_id: int) -> None:
+        self.public_ids.discard(channel_id)
+        self.private_ids.discard(channel_id)
+
+    def to_state(self) -> dict[str, list[int]]:
+        return {"public": sorted(self.public_ids), "private": sorted(self.private_ids)}
+
+    def load_state(self, state: dict[str, list[int]]) -> None:
+        self.public_ids = set(state.get("public", ()))
+        self.private_ids = set(state.get("private", ()))
+
+    def is_public(self, channel_id: int) -> bool:
+        return channel_id in self.public_ids
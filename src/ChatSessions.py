@@ -0,0 +1,90 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Hashable, Optional
+
+import discord
+
+
+@dataclass
+class ChatSessionEntry:
+    chat: Any
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    last_used: float = field(default_factory=time.monotonic)
+    summary_task: Optional[asyncio.Task] = None
+    closed: bool = False  # discard() された。待機中の呼び出しもこのチャットには送信しない
+
+
+class ChatSessionPool:
+    """Chat sessions keyed by channel (and thread) with LRU and idle-TTL eviction"""
+
+    def __init__(self, factory: Callable[[], Any], max_size: int = 64, idle_ttl: float = 3600.0) -> None:
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._sessions: OrderedDict[Hashable, ChatSessionEntry] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    @staticmethod
+    def key_for(channel) -> tuple[int, Optional[int]]:
+        """Threads get their own session, separate from the parent channel"""
+        if isinstance(channel, discord.Thread):
+            return channel.parent_id, channel.id
+        return channel.id, None
+
+    def get(self, key: Hashable) -> ChatSessionEntry:
+        self._evict_idle()
+        entry = self._sessions.get(key)
+        if entry is None:
+            entry = ChatSessionEntry(chat=self.factory())
+            self._sessions[key] = entry
+            self._evict_overflow()
+        else:
+            self._sessions.move_to_end(key)
+        entry.last_used = time.monotonic()
+        return entry
+
+    @asynccontextmanager
+    async def session(self, key: Hashable) -> AsyncIterator[ChatSessionEntry]:
+        """Hold the per-session lock so one chat history is never sent concurrently"""
+        while True:
+            entry = self.get(key)
+            async with entry.lock:
+                if entry.closed:
+                    # 待っている間に破棄されたので、新しいセッションを取り直す
+                    continue
+                try:
+                    yield entry
+                finally:
+                    entry.last_used = time.monotonic()
+                return
+
+    def discard(self, key: Hashable) -> None:
+        entry = self._sessions.pop(key, None)
+        if entry is not None:
+            entry.closed = True
+
+    def clear(self) -> None:
+        for entry in self._sessions.values():
+            entry.closed = True
+        self._sessions.clear()
+
+    def _evict_idle(self) -> None:
+        deadline = time.monotonic() - self.idle_ttl
+        for key, entry in list(self._sessions.items()):
+            if entry.last_used >= deadline:
+                break
+            if not entry.lock.locked():
+                del self._sessions[key]
+
+    def _evict_overflow(self) -> None:
+        # 使用中のセッションは追い出さない
+        for key, entry in list(self._sessions.items()):
+            if len(self._sessions) <= self.max_size:
+                break
+            if not entry.lock.locked():
+                del self._sessions[key]
@@ -0,0 +1,202 @@
+import asyncio
+import uuid
+from typing import Optional, Sequence
+
+import discord
+from discord.ext import commands, tasks
+
+from Config import settings
+from src import Entities, Session
+from src.EmbeddingWorker import EmbeddingWorker
+from src.Embeddings import create_embedder
+from src.HistoryBackfill import HistoryBackfill
+from src.StateStore import StateStore
+
+
+class Archive(commands.Cog):
+    """保存されたメッセージのアーカイブ（埋め込みベクトルなど）を管理する"""
+
+    def __init__(self, bot, logger, llm):
+        self.bot = bot
+        self.logger = logger
+        self.vector_index = bot.vector_index
+        self.embedder = create_embedder(llm)
+        self.embedding_worker = EmbeddingWorker(
+            self.embedder,
+            self._fetch_contents,
+            self.logger,
+            StateStore(settings.STATE_DIR, "embedding_checkpoint"),
+            batch_size=settings.EMBEDDING_BATCH_SIZE,
+            vector_index=self.vector_index,
+        )
+        self.history_backfill = HistoryBackfill(
+            self.logger,
+            StateStore(settings.STATE_DIR, "backfill_checkpoint"),
+            concurrency=settings.BACKFILL_CONCURRENCY,
+            requests_per_second=settings.BACKFILL_REQUESTS_PER_SECOND,
+            batch_size=settings.BACKFILL_BATCH_SIZE,
+        )
+        self.backfill_task: Optional[asyncio.Task] = None
+        # 組み込みのベクトル索引を使う場合、新着メッセージをまとめて索引に追加する
+        self.pending_live: list[tuple[int, int, str]] = []
+        if settings.get_db_url() and settings.RETRIEVAL_ENABLED:
+            # 埋め込みは検索にしか使わないので、検索が無効なら Gemini のクォータを消費しない
+            self.embed_pending.start()
+        if settings.RETRIEVAL_ENABLED and self.vector_index.ingests_live_messages:
+            self.index_live_messages.start()
+            self.flush_vector_index.start()
+
+    def cog_unload(self):
+        for loop in (self.embed_pending, self.index_live_messages, self.flush_vector_index):
+            if loop.is_running():
+                loop.cancel()
+        self.vector_index.flush()
+
+    async def _fetch_contents(self, rows: Sequence[Entities.Message]) -> dict[uuid.UUID, str]:
+        """保存された行に対応するDiscordのメッセージ本文を取得する（削除済みは空文字列、取得できなければ含めない）"""
+        resolver = self.bot.message_resolver
+        resolved = await resolver.resolve((row.channel_id, row.msg_id) for row in rows)
+        contents = {}
+        for row in rows:
+            if row.msg_id in resolved:
+                contents[row.pk] = resolved[row.msg_id].content
+            elif resolver.is_deleted(row.msg_id):
+                contents[row.pk] = ""
+        return contents
+
+    @tasks.loop(minutes=10)
+    async def embed_pending(self):
+        """埋め込みがまだない行を定期的に処理する"""
+        try:
+            await self.embedding_worker.run()
+        except Exception as e:
+            self.logger.error(f"Error in embed_pending: {e}")
+
+    @embed_pending.before_loop
+    async def before_embed_pending(self):
+        await self.bot.wait_until_ready()
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        self.bot.message_resolver.invalidate(payload.message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        self.bot.message_resolver.invalidate(payload.message_id)
+        await self._forget_authors([payload.message_id])
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        for message_id in payload.message_ids:
+            self.bot.message_resolver.invalidate(message_id)
+        await self._forget_authors(list(payload.message_ids))
+
+    async def _forget_authors(self, message_ids: list[int]):
+        if self.bot.author_index is None:
+            return
+        try:
+            await self.bot.author_index.forget(message_ids)
+        except Exception as e:
+            self.logger.error(f"Error removing deleted messages from the author index: {e}")
+
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        if message.guild is None:
+            return
+        if self.bot.author_index is not None:
+            # 投稿者ごとのメッセージ一覧（削除やデータ書き出し用）に記録する
+            await self.bot.author_index.record(message)
+        if not self.index_live_messages.is_running():
+            return
+        if message.author.bot or not message.content:
+            return
+        self.pending_live.append((message.channel.id, message.id, message.content))
+
+    @tasks.loop(seconds=30)
+    async def index_live_messages(self):
+        """溜まった新着メッセージを埋め込んでベクトル索引に追加する"""
+        while self.pending_live:
+            batch = self.pending_live[:settings.EMBEDDING_BATCH_SIZE]
+            del self.pending_live[:len(batch)]
+            try:
+                vectors = await self.embedder.embed([content for _, _, content in batch])
+            except Exception as e:
+                self.logger.error(f"Error in index_live_messages: {e}")
+                return
+            self.vector_index.add((channel_id, msg_id, vector)
+                                  for (channel_id, msg_id, _), vector in zip(batch, vectors))
+
+    @index_live_messages.before_loop
+    async def before_index_live_messages(self):
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(minutes=10)
+    async def flush_vector_index(self):
+        """追加した行をディスクに書き出す（追加直後から検索には使われる）"""
+        try:
+            self.vector_index.flush()
+        except Exception as e:
+            self.logger.error(f"Error in flush_vector_index: {e}")
+
+    @commands.command()
+    @commands.has_role("Parent")
+    async def embed_messages(self, ctx, max_batches: int = 10):
+        """埋め込みがまだないメッセージを今すぐ処理する"""
+        async with ctx.typing():
+            try:
+                embedded, rate = await self.embedding_worker.run(max_batches=max_batches)
+            except Exception as e:
+                self.logger.error(f"Error in embed_messages: {e}")
+                await ctx.reply("埋め込みの生成中にエラーが発生しました。")
+                return
+        await ctx.reply(f"{embedded}件のメッセージの埋め込みを生成しました。({rate:.1f}件/秒)")
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_role("Parent")
+    async def backfill_history(self, ctx):
+        """全チャンネルとスレッドの過去メッセージをデータベースに保存する（前回の続きから再開）"""
+        if not settings.get_db_url():
+            await ctx.reply("データベースが設定されていません。")
+            return
+        if self.backfill_task is not None and not self.backfill_task.done():
+            await ctx.reply("過去メッセージの取り込みはすでに実行中です。")
+            return
+
+        await ctx.reply("過去メッセージの取り込みを開始します。")
+        self.backfill_task = asyncio.create_task(self.history_backfill.run(ctx.guild))
+        try:
+            result = await self.backfill_task
+        except Exception as e:
+            self.logger.error(f"Error in backfill_history: {e}")
+            await ctx.reply("過去メッセージの取り込み中にエラーが発生しました。")
+            return
+        self.logger.info(f"Backfill finished: {result}")
+        if result.messages:
+            # 取り込んだ行は投稿日時順でチェックポイントより前に入るので、次の埋め込みは先頭から
+            self.embedding_worker.rewind()
+        summary = f"{result.channels}チャンネルから{result.messages}件のメッセージを保存しました。({result.elapsed:.0f}秒)"
+        if result.failed_channels:
+            summary += f"\n{result.failed_channels}チャンネルで失敗しました。もう一度実行すると続きから再開します。"
+        await ctx.reply(summary)
+
+    @commands.command()
+    @commands.has_role("Parent")
+    async def db_status(self, ctx):
+        """データベース接続プールの状態を表示する"""
+        if not settings.get_db_url():
+            await ctx.reply("データベースが設定されていません。")
+            return
+        stats = Session.pool_stats()
+        lines = [
+            "データベースの状態:",
+            f"- 接続: 使用中 {stats['checked_out']} / プール {stats['size']} (超過 {stats['overflow']}), "
+            f"使用率 {stats['utilization']:.0%}",
+            f"- 接続取得: {stats['checkouts']}回 (平均 {stats['avg_checkout'] * 1000:.1f}ms, "
+            f"p95 {stats['p95_checkout'] * 1000:.1f}ms)",
+        ]
+        if self.bot.message_writer is not None:
+            writer = self.bot.message_writer.stats()
+            lines.append(f"- 書き込み待ち: {writer['pending']}件 (保存済み: {writer['written']}件, "
+                         f"{writer['batches']}バッチ, 破棄: {writer['dropped']}件)")
+        await ctx.reply("\n".join(lines))
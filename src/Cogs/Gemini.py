@@ -8,11 +8,24 @@ import random
 import datetime
 from typing import List, Optional
 import re
+from contextlib import aclosing
 
+from Config import settings
 from src import Entities, Session
+from src.ChatSessions import ChatSessionPool
 from src.Cogs.Utils import sanitize_args
+from src.Embeddings import create_embedder
+from src.HistoryBudget import HistoryBudget
+from src.MessageBuffer import ChannelMessageBuffer
+from src.QuotaGovernor import CircuitBreaker, LLMUnavailable, QuotaGovernor
+from src.LLMClient import LLMClient
+from src.LLMScheduler import LLMQueueFull, Priority
 from src.Models import MessagePayload
+from src.PurgeEngine import PurgeEngine, PurgeProgress
 from src.Repositories import DatabaseRepository
+from src.ResponseCache import ResponseCache
+from src.Retrieval import Retriever
+from src.StreamingReply import StreamingReply
 
 class Gemini(commands.Cog):
     SAFETY_SETTINGS = [
@@ -22,10 +35,13 @@ class Gemini(commands.Cog):
         {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
     ]
     MESSAGE_HISTORY_LIMIT = 50  # Default message history limit
+    BUSY_REPLY = "ただいまAIが混み合っています。少し時間をおいてからもう一度話しかけてください🙏"
+    ERROR_REPLY = "申し訳ありません。メッセージの処理中にエラーが発生しました。"
 
     def __init__(self, bot, api_key, logger, initial_prompt):
         self.bot = bot
         self.logger = logger
+        self.dispatcher = bot.dispatcher
         self.initial_prompt = [
             {"role": "user", "parts": [initial_prompt]}
         ]
@@ -46,15 +62,81 @@ class Gemini(commands.Cog):
             safety_settings=self.SAFETY_SETTINGS  # Added safety settings
         )
 
-        self.chat = self.model.start_chat(history=self.initial_prompt)
+        self.llm = LLMClient(
+            self.model,
+            self.logger,
+            max_workers=settings.LLM_MAX_WORKERS,
+            max_concurrency=settings.LLM_MAX_CONCURRENCY,
+            timeout=settings.LLM_TIMEOUT_SECONDS,
+            max_background_queue=settings.LLM_BACKGROUND_QUEUE_LIMIT,
+            background_max_wait=settings.LLM_BACKGROUND_MAX_WAIT,
+            governor=QuotaGovernor(
+                requests_per_minute=settings.GEMINI_REQUESTS_PER_MINUTE,
+                tokens_per_minute=settings.GEMINI_TOKENS_PER_MINUTE,
+                max_attempts=settings.LLM_MAX_ATTEMPTS,
+                breaker=CircuitBreaker(
+                    failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+                    reset_timeout=settings.LLM_CIRCUIT_RESET_SECONDS,
+                    probe_timeout=settings.LLM_CIRCUIT_PROBE_TIMEOUT,
+                ),
+            ),
+            embedding_governor=QuotaGovernor(
+                requests_per_minute=settings.GEMINI_EMBED_REQUESTS_PER_MINUTE,
+                max_attempts=settings.LLM_MAX_ATTEMPTS,
+                breaker=CircuitBreaker(
+                    failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+                    reset_timeout=settings.LLM_CIRCUIT_RESET_SECONDS,
+                    probe_timeout=settings.LLM_CIRCUIT_PROBE_TIMEOUT,
+                ),
+            ),
+        )
+        self.chat_sessions = ChatSessionPool(
+            self._start_chat,
+            max_size=settings.CHAT_SESSION_MAX_SIZE,
+            idle_ttl=settings.CHAT_SESSION_IDLE_TTL,
+        )
+        self.history_budget = HistoryBudget(
+            self._summarize_history,
+            self.logger,
+            max_tokens=settings.CHAT_HISTORY_TOKEN_BUDGET,
+            keep_recent_turns=settings.CHAT_HISTORY_KEEP_TURNS,
+        )
+        self.response_cache = ResponseCache(
+            max_size=settings.RESPONSE_CACHE_SIZE,
+            ttl=settings.RESPONSE_CACHE_TTL,
+        )
+        self.message_buffer = ChannelMessageBuffer(capacity=self.MESSAGE_HISTORY_LIMIT)
+        self.purge_engine = PurgeEngine(
+            self.logger,
+            requests_per_second=settings.PURGE_REQUESTS_PER_SECOND,
+            concurrency=settings.PURGE_CONCURRENCY,
+            progress_interval=settings.PURGE_PROGRESS_INTERVAL,
+        )
+        self.retriever = None
+        if settings.RETRIEVAL_ENABLED:
+            self.retriever = Retriever(
+                bot,
+                create_embedder(self.llm, task_type="retrieval_query"),
+                bot.vector_index,
+                self.logger,
+                k=settings.RETRIEVAL_TOP_K,
+                budget=settings.RETRIEVAL_BUDGET_SECONDS,
+                min_score=settings.RETRIEVAL_MIN_SCORE,
+                scope=settings.RETRIEVAL_SCOPE,
+            )
+        self.stream_responses = settings.STREAM_RESPONSES
         self.last_check_channel = None
         # 定期チェックはデフォルトでは開始しない
         self.periodic_infant_check.stop()
 
+    def _start_chat(self):
+        return self.model.start_chat(history=self.initial_prompt)
+
     def cog_unload(self):
         """Cogがアンロードされるときにタスクを停止"""
         if self.periodic_infant_check.is_running():
             self.periodic_infant_check.cancel()
+        self.llm.close()
 
     @tasks.loop(minutes=30)  # 30分ごとに実行
     async def periodic_infant_check(self):
@@ -110,11 +192,14 @@ class Gemini(commands.Cog):
             - チャットが空の場合は、一般的な話題（趣味、好きなもの、最近のできごとなど）について質問
             """
 
-            response = await self._generate_response(prompt)
+            response = await self._generate_response(prompt, priority=Priority.BACKGROUND)
             await channel.send(f"{infant.mention} {response}")
             self.last_check_channel = channel
             self.logger.info(f"Periodic check completed - messaged {infant.display_name} in {channel.name}")
 
+        except (LLMQueueFull, LLMUnavailable):
+            # 混雑時は定期チェックを見送る
+            self.logger.info("Periodic check skipped because the LLM queue is busy")
         except Exception as e:
             self.logger.error(f"Error in periodic_infant_check: {e}")
 
@@ -125,6 +210,7 @@ class Gemini(commands.Cog):
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
+        self.message_buffer.append(message)
         if message.mentions and self.bot.user in message.mentions \
                 and message.author != self.bot.user \
                 and message.channel.id != 1173806749757743134:
@@ -132,6 +218,14 @@ class Gemini(commands.Cog):
             async with message.channel.typing():
                 await self.process_message(content, message, message.author.display_name)
 
+    @commands.Cog.listener()
+    async def on_message_edit(self, before: discord.Message, after: discord.Message):
+        self.message_buffer.edit(after)
+
+    @commands.Cog.listener()
+    async def on_message_delete(self, message: discord.Message):
+        self.message_buffer.delete(message.channel.id, message.id)
+
     @commands.command()
     @commands.has_any_role("Parent", "Toddler")
     async def gem(self, ctx, *args):
@@ -143,18 +237,18 @@ class Gemini(commands.Cog):
     @commands.has_any_role("Parent", "Toddler")
     async def save_message(self, ctx, *args):
         try:
-            async with ctx.typing():
-                message = MessagePayload(
-                    member_id=ctx.author.id,
-                    channel_id=ctx.channel.id,
-                    msg_id=ctx.message.id,
-                    created_at=ctx.message.created_at.astimezone(timezone.utc).replace(tzinfo=None)
-                )
-                async for session in Session.get_db_session():
-                    self.logger.info(f"Saving message: {message.dict()}")
-                    repo = DatabaseRepository(Entities.Message, session)
-                    await repo.create(message.dict())
-                    await ctx.send("Message saved successfully!")
+            if self.bot.message_writer is None:
+                raise RuntimeError("database is not configured")
+            message = MessagePayload(
+                member_id=ctx.author.id,
+                channel_id=ctx.channel.id,
+                msg_id=ctx.message.id,
+                created_at=ctx.message.created_at.astimezone(timezone.utc).replace(tzinfo=None)
+            )
+            self.logger.info(f"Saving message: {message.dict()}")
+            # 保存はまとめて後から行う（混雑時は空きが出るまで待つ）
+            await self.bot.message_writer.put(message)
+            await ctx.send("Message saved successfully!")
         except Exception as e:
             self.logger.error(f"Error saving message: {str(e)}")
             await ctx.send("Failed to save message. Please try again later.")
@@ -165,14 +259,19 @@ class Gemini(commands.Cog):
         try:
             async with ctx.typing():
                 async for session in Session.get_db_session():
-                    self.logger.info("Getting all messages")
+                    self.logger.info("Getting recent messages")
                     repo = DatabaseRepository(Entities.Message, session)
-                    messages = await repo.get_all()
+                    messages = await repo.list(limit=10, newest_first=True)
                     if not messages:
                         await ctx.send("No messages found.")
                         return
                     # Format messages in a more readable way
-                    formatted_messages = "\n".join(f"Message ID: {msg.msg_id}" for msg in messages[:10])
+                    resolved = await self.bot.message_resolver.resolve(
+                        (msg.channel_id, msg.msg_id) for msg in messages)
+                    formatted_messages = "\n".join(
+                        f"Message ID: {msg.msg_id} - {resolved[msg.msg_id].content[:100]}"
+                        if msg.msg_id in resolved else f"Message ID: {msg.msg_id} (deleted)"
+                        for msg in messages)
                     await ctx.send(f"Recent messages:\n{formatted_messages}")
         except Exception as e:
             self.logger.error(f"Error retrieving messages: {str(e)}")
@@ -193,84 +292,147 @@ class Gemini(commands.Cog):
             await reply_func.reply('どしたん?話きこか?')
             return
 
-        # Fetch messages from the channel using the configurable limit
+        # Read recent messages from the channel buffer using the configurable limit (oldest first)
         channel = reply_func.channel if hasattr(reply_func, 'channel') else reply_func.message.channel
-        messages = []
-        async for msg in channel.history(limit=self.MESSAGE_HISTORY_LIMIT):
-            if msg.author != self.bot.user:  # Only include user messages
-                messages.append(f"{msg.author.display_name}: {msg.content}")
-        
-        # Reverse messages to show oldest first
-        messages.reverse()
-        
+        recent = await self.message_buffer.recent(channel, self.MESSAGE_HISTORY_LIMIT)
+        messages = [
+            f"{msg.author_name}: {msg.content}"
+            for msg in recent
+            if msg.author_id != self.bot.user.id  # Only include user messages
+        ]
+
         # Create context with previous messages
         context = "Previous messages:\n" + "\n".join(messages) + "\n\nCurrent message:\n"
+        if self.retriever is not None:
+            # 直近の履歴に含まれない、過去の関連メッセージを追加（時間切れの場合は直近の履歴のみ）
+            related = await self.retriever.related(arguments, channel, exclude_ids={msg.id for msg in recent})
+            if related:
+                context = "Related earlier messages:\n" + "\n".join(related) + "\n\n" + context
         
+        user_id = reply_func.author.id
+        if self.stream_responses:
+            await self._stream_reply(f"{context}{author_name}: {arguments}", reply_func, channel, author_name, user_id)
+            return
+
         try:
-            response = await self.send_chat_message(f"{context}{author_name}: {arguments}")
+            response = await self.send_chat_message(f"{context}{author_name}: {arguments}", channel, user_id)
             response_text = response.text if hasattr(response, 'text') else str(response)
-            
-            # Split long messages
-            if len(response_text) > 2000:
-                chunks = [response_text[i:i+1990] for i in range(0, len(response_text), 1990)]
-                for chunk in chunks:
-                    try:
-                        await reply_func.reply(chunk)
-                    except discord.errors.HTTPException as e:
-                        # メッセージが見つからない場合は通常のメッセージとして送信
-                        if e.code == 50035 and "Unknown message" in str(e):
-                            await channel.send(f"**{author_name}へ返信:** {chunk}")
-                        else:
-                            # その他のHTTPエラーは再スロー
-                            raise
-            else:
-                try:
-                    await reply_func.reply(response_text)
-                except discord.errors.HTTPException as e:
-                    # メッセージが見つからない場合は通常のメッセージとして送信
-                    if e.code == 50035 and "Unknown message" in str(e):
-                        await channel.send(f"**{author_name}へ返信:** {response_text}")
-                    else:
-                        # その他のHTTPエラーは再スロー
-                        raise
-                        
+            # 長いメッセージは分割し、返信先が消えていれば通常のメッセージとして送信される
+            await self.dispatcher.reply(reply_func, response_text, fallback_prefix=f"**{author_name}へ返信:** ")
         except Exception as e:
             self.logger.error(f"Error in process_message: {e}")
+            await self.dispatcher.reply(reply_func, self.ERROR_REPLY)
+
+    async def _stream_reply(self, prompt, reply_func, channel, author_name, user_id=None):
+        """プレースホルダーを投稿し、応答を受信しながら編集していく"""
+        async def post(text):
+            messages = await self.dispatcher.reply(reply_func, text, fallback_prefix=f"**{author_name}へ返信:** ")
+            return messages[0]
+
+        async def send_more(text):
+            messages = await self.dispatcher.send(channel, text, merge=False)
+            return messages[0]
+
+        reply = StreamingReply(post, send_more, edit_interval=settings.STREAM_EDIT_INTERVAL,
+                               empty_reply=self.ERROR_REPLY)
+        try:
+            await reply.start()
+            async with aclosing(self.stream_chat_message(prompt, channel, user_id)) as chunks:
+                async for chunk in chunks:
+                    await reply.feed(chunk)
+            await reply.finish()
+        except Exception as e:
+            self.logger.error(f"Error in _stream_reply: {e}")
+            error_text = self.BUSY_REPLY if isinstance(e, LLMUnavailable) else self.ERROR_REPLY
             try:
-                await reply_func.reply("申し訳ありません。メッセージの処理中にエラーが発生しました。")
+                if reply.message is None:
+                    await self.dispatcher.send(channel, error_text)
+                elif reply.total_length == 0:
+                    await reply.message.edit(content=error_text)
+                else:
+                    await reply.finish("\n…（応答が中断されました）")
             except discord.errors.HTTPException:
-                # 返信できない場合は通常のメッセージとして送信
-                await channel.send("申し訳ありません。メッセージの処理中にエラーが発生しました。")
+                pass
 
-    async def send_chat_message(self, msg):
-        """Asynchronously send a message to the chat with retry logic"""
-        max_attempts = 3
-        for attempt in range(1, max_attempts + 1):
+    async def stream_chat_message(self, msg, channel, user_id=None):
+        """Stream the channel's chat session reply chunk by chunk"""
+        key = ChatSessionPool.key_for(channel)
+        async with self.chat_sessions.session(key) as session:
+            started = False
             try:
-                # Wrap the synchronous API call in an executor to make it async
-                response = await asyncio.get_event_loop().run_in_executor(
-                    None, self.chat.send_message, msg
-                )
-                return response
+                async with aclosing(self.llm.stream_message(session.chat, msg, user_id=user_id)) as chunks:
+                    async for chunk in chunks:
+                        started = True
+                        yield chunk
+                # SAFETY などで止まったストリームは例外にならず、その後 history を読むたびに例外になる
+                self._repair_session(key, session)
+                self.history_budget.maybe_compact(session)
+            except Exception as e:
+                if started or isinstance(e, asyncio.TimeoutError):
+                    # 途中で切れたストリームや、タイムアウト後もスレッドが書き込み続ける履歴は壊れるので
+                    # セッションを作り直す
+                    self.chat_sessions.discard(key)
+                else:
+                    self._repair_session(key, session)
+                raise
+
+    async def send_chat_message(self, msg, channel, user_id=None):
+        """Send a message to the channel's chat session; retries and backoff are handled by the quota governor"""
+        key = ChatSessionPool.key_for(channel)
+        async with self.chat_sessions.session(key) as session:
+            try:
+                response = await self.llm.send_message(session.chat, msg, user_id=user_id)
+            except LLMUnavailable as e:
+                self.logger.warning(f"Gemini unavailable in send_chat_message: {e}")
+                return self.BUSY_REPLY
             except asyncio.TimeoutError:
-                if attempt == max_attempts:
-                    return f"Timeout error: The request took too long to complete after {max_attempts} attempts."
-                await asyncio.sleep(1)  # Add delay between retries
+                self.logger.error("Timeout in send_chat_message")
+                # スレッドはまだ応答を待っており、後から履歴に追記するので次の会話には使わない
+                self.chat_sessions.discard(key)
+                return self.BUSY_REPLY
             except Exception as e:
-                if attempt == max_attempts:
-                    self.logger.error(f"Error in send_chat_message: {str(e)}")
-                    return f"An error occurred after {max_attempts} attempts: {str(e)}"
-                await asyncio.sleep(1)
-
-    async def _generate_response(self, prompt: str) -> str:
-        """Generate a response using the chat model"""
+                self.logger.error(f"Error in send_chat_message: {str(e)}")
+                self._repair_session(key, session)
+                return self.ERROR_REPLY
+            self.history_budget.maybe_compact(session)
+            return response
+
+    @staticmethod
+    def _history_readable(chat) -> bool:
         try:
-            # Create a new chat for one-off responses
-            temp_chat = self.model.start_chat()
-            response = await asyncio.get_event_loop().run_in_executor(
-                None, temp_chat.send_message, prompt
-            )
+            chat.history
+        except Exception:
+            return False
+        return True
+
+    def _repair_session(self, key, session) -> None:
+        """途中で止まった応答のせいで履歴を読めなくなったセッションは、そのやり取りを取り消すか作り直す"""
+        if self._history_readable(session.chat):
+            return
+        self.logger.warning(f"Chat history of {key} is broken (stopped candidate), rewinding")
+        try:
+            session.chat.rewind()
+        except Exception:
+            pass
+        if not self._history_readable(session.chat):
+            self.chat_sessions.discard(key)
+
+    async def _summarize_history(self, prompt: str) -> str:
+        """Summarize older chat turns for the history budget"""
+        response = await self.llm.generate(prompt, priority=Priority.BACKGROUND)
+        return response.text
+
+    async def _generate_response(self, prompt: str, priority: Priority = Priority.COMMAND, user_id=None) -> str:
+        """Generate a one-off response, served from the response cache when possible"""
+        async def generate():
+            # One-off responses don't need a chat session
+            response = await self.llm.generate(prompt, priority=priority, user_id=user_id)
             return response.text if hasattr(response, 'text') else str(response)
+
+        try:
+            return await self.response_cache.get_or_create(prompt, generate)
+        except (LLMQueueFull, LLMUnavailable):
+            raise
         except Exception as e:
             self.logger.error(f"Error in _generate_response: {str(e)}")
             return "申し訳ありません。応答の生成中にエラーが発生しました。"
@@ -329,6 +491,34 @@ class Gemini(commands.Cog):
                           f"- 間隔: {interval}分\n"
                           f"- 次回実行: 未定")
 
+    @commands.command()
+    @commands.has_role("Parent")
+    async def llm_status(self, ctx):
+        """Gemini呼び出しの統計を表示する"""
+        cache = self.response_cache.stats()
+        queue = self.llm.scheduler.stats()
+        quota = self.llm.governor.stats()
+        embedding_quota = self.llm.embedding_governor.stats()
+        lines = [
+            "LLMの状態:",
+            f"- チャットセッション数: {len(self.chat_sessions)}",
+            f"- 応答キャッシュ: {cache['size']}件 "
+            f"(ヒット: {cache['hits']}, ミス: {cache['misses']}, ヒット率: {cache['hit_rate']:.0%}, "
+            f"実行中: {cache['in_flight']})",
+            f"- 実行枠: {queue['active']}/{queue['capacity']} (破棄: {queue['dropped']}件)",
+            f"- 回路: {quota['state']} (429/5xx: {quota['throttled']}回, 即時拒否: {quota['rejected']}回)",
+            f"- 埋め込みの回路: {embedding_quota['state']} (429/5xx: {embedding_quota['throttled']}回, "
+            f"即時拒否: {embedding_quota['rejected']}回)",
+        ]
+        for name, info in queue['queues'].items():
+            lines.append(f"  - {name}: 待機 {info['depth']}件, 平均待ち {info['avg_wait']:.1f}秒, "
+                         f"最大待ち {info['max_wait']:.1f}秒")
+        if self.retriever is not None:
+            retrieval = self.retriever.stats()
+            lines.append(f"- 関連メッセージ検索: {retrieval['calls']}回 (平均 {retrieval['avg_latency'] * 1000:.0f}ms, "
+                         f"時間切れ・失敗: {retrieval['fallbacks']}回)")
+        await ctx.reply("\n".join(lines))
+
     @commands.command()
     @commands.has_role("Parent")
     async def list_channels(self, ctx, category_id: Optional[int] = None):
@@ -357,13 +547,7 @@ class Gemini(commands.Cog):
                         channels_info.append(f"  {sync_status} {channel.name} (ID: {channel.id})")
 
             # メッセージが2000文字を超える場合は分割して送信
-            message = "\n".join(channels_info)
-            if len(message) > 1990:
-                chunks = [message[i:i+1990] for i in range(0, len(message), 1990)]
-                for chunk in chunks:
-                    await ctx.reply(f"```\n{chunk}\n```")
-            else:
-                await ctx.reply(f"```\n{message}\n```")
+            await self.dispatcher.reply(ctx, "\n".join(channels_info), code_block=True)
 
         except Exception as e:
             self.logger.error(f"Error in list_channels: {e}")
@@ -434,22 +618,8 @@ class Gemini(commands.Cog):
                     if result["failed"]:
                         response.append(f"  ❌ 同期失敗: {', '.join(result['failed'])}")
 
-            # 結果が長い場合は分割して送信
-            formatted_response = "\n".join(response)
-            if len(formatted_response) > 1990:
-                # 進捗メッセージを更新
-                await status_msg.edit(content="✅ 同期完了！詳細な結果を送信します...")
-                
-                # 結果を分割して送信
-                chunks = [formatted_response[i:i+1990] for i in range(0, len(formatted_response), 1990)]
-                for i, chunk in enumerate(chunks):
-                    if i == 0:
-                        await ctx.reply(f"```\n{chunk}\n```")
-                    else:
-                        await ctx.send(f"```\n{chunk}\n```")
-            else:
-                # 進捗メッセージを結果で更新
-                await status_msg.edit(content=f"```\n{formatted_response}\n```")
+            # 進捗メッセージを結果で更新し、長い場合は続きを分割して送信
+            await self.dispatcher.edit(status_msg, "\n".join(response), code_block=True)
 
         except Exception as e:
             self.logger.error(f"Error in sync_all_permissions: {e}")
@@ -531,7 +701,11 @@ class Gemini(commands.Cog):
             - 絵文字を1-2個使用
             """
             
-            response = await self._generate_response(prompt)
+            try:
+                response = await self._generate_response(prompt, user_id=ctx.author.id)
+            except LLMUnavailable:
+                await ctx.reply(self.BUSY_REPLY)
+                return
             await ctx.send(f"{infant.mention} {response}")
 
     @commands.command()
@@ -567,26 +741,24 @@ class Gemini(commands.Cog):
             - 絵文字を1-2個使用
             """
 
-            response = await self._generate_response(prompt)
+            try:
+                response = await self._generate_response(prompt, user_id=ctx.author.id)
+            except LLMUnavailable:
+                await ctx.reply(self.BUSY_REPLY)
+                return
             await ctx.send(f"{infant.mention} {response}")
 
     async def _get_recent_messages(self, channel, limit=10) -> List[str]:
-        """Get recent messages from the channel"""
+        """Get recent messages from the channel buffer, newest first"""
         messages = []
-        async for message in channel.history(limit=limit):
-            if not message.author.bot and message.content:  # Skip bot messages and empty messages
+        for message in reversed(await self.message_buffer.recent(channel, limit)):
+            if not message.author_bot and message.content:  # Skip bot messages and empty messages
                 messages.append(message.content)
         return messages
 
     async def _get_random_infant(self, guild) -> Optional[discord.Member]:
         """Get a random member with Infant role"""
-        infant_role = discord.utils.get(guild.roles, name="Infant")
-        if not infant_role:
-            return None
-        
-        infant_members = [member for member in guild.members 
-                         if infant_role in member.roles and not member.bot]
-        return random.choice(infant_members) if infant_members else None
+        return await self.bot.role_index.random_member(guild, "Infant")
 
     @commands.command()
     async def help_command(self, ctx):
@@ -601,6 +773,7 @@ class Gemini(commands.Cog):
             "stop_periodic_check": "定期チェックを停止します",
             "start_periodic_check": "定期チェックを開始します",
             "check_status": "定期チェックの状態を確認します",
+            "llm_status": "Gemini呼び出しの統計を表示します",
             "list_channels": "チャンネル一覧と権限同期状態を表示します",
             "list_categories": "カテゴリー一覧を表示します",
             "sync_all_permissions": "すべてのチャンネルの権限を同期します",
@@ -618,7 +791,7 @@ class Gemini(commands.Cog):
         for cmd_name, cmd_desc in commands_help.items():
             # Parent専用コマンド
             if cmd_name in ["set_check_interval", "stop_periodic_check", "start_periodic_check", 
-                          "check_status", "list_channels", "list_categories", "sync_all_permissions", 
+                          "check_status", "llm_status", "list_channels", "list_categories", "sync_all_permissions", 
                           "sync_permissions", "check_infant", "discuss_topic"]:
                 if is_parent:
                     available_commands.append((cmd_name, cmd_desc))
@@ -638,13 +811,7 @@ class Gemini(commands.Cog):
             help_lines.append(f"**!{cmd_name}**\n└ {cmd_desc}\n")
 
         # メッセージが2000文字を超える場合は分割して送信
-        help_message = "\n".join(help_lines)
-        if len(help_message) > 1990:
-            chunks = [help_message[i:i+1990] for i in range(0, len(help_message), 1990)]
-            for chunk in chunks:
-                await ctx.reply(chunk)
-        else:
-            await ctx.reply(help_message)
+        await self.dispatcher.reply(ctx, "\n".join(help_lines))
 
     @commands.command()
     async def show_prompt(self, ctx):
@@ -688,8 +855,8 @@ class Gemini(commands.Cog):
                     return
 
             self.initial_prompt = [{"role": "user", "parts": [self.default_initial_prompt]}]
-            # デフォルトのプロンプトでチャットを初期化
-            self.chat = self.model.start_chat(history=self.initial_prompt)
+            # デフォルトのプロンプトでチャットを初期化（全チャンネルのセッションを破棄）
+            self.chat_sessions.clear()
             await ctx.reply("✅ initial promptをデフォルトの内容に戻し、チャットを初期化しました。\n"
                           "現在のプロンプトの内容を確認するには `!show_prompt` を使用してください。")
         except Exception as e:
@@ -789,14 +956,30 @@ class Gemini(commands.Cog):
         # 既存のreturn False
         return False
 
+    async def _indexed_purge_targets(self, guild, user_id: int) -> list:
+        """投稿者インデックスにあるユーザーのメッセージを (チャンネル, メッセージID一覧) にまとめる"""
+        targets = []
+        for channel_id, msg_ids in (await self.bot.author_index.messages_by_channel(user_id)).items():
+            channel = guild.get_channel_or_thread(channel_id)
+            if channel is None:
+                # アーカイブされたスレッドはキャッシュにないためAPIで取得する
+                try:
+                    channel = await guild.fetch_channel(channel_id)
+                except (discord.NotFound, discord.Forbidden):
+                    continue
+            targets.append((channel, msg_ids))
+        return targets
+
     @commands.command()
     @commands.has_role("Parent")
-    async def purge_user(self, ctx, user_input: str = None, limit: int = 0):
+    async def purge_user(self, ctx, user_input: str = None, limit: int = 0, mode: str = "scan"):
         """指定したユーザーのメッセージをサーバー全体から完全に削除します
         
         引数:
         user_input: 削除対象のユーザー（メンション、ID、ユーザー名のいずれか）
         limit: 削除するメッセージの最大件数 (0=制限なし、デフォルト: 制限なし)
+        mode: "scan"=全チャンネルの履歴を調べる (デフォルト), "index"=投稿者インデックスにあるメッセージだけを削除する
+              （インデックスに記録される前のメッセージは、backfill_history で取り込んでいない限り残る）
         """
         # DMでの使用を検出してエラーメッセージを表示
         if not ctx.guild:
@@ -806,6 +989,13 @@ class Gemini(commands.Cog):
         if user_input is None:
             await ctx.send("❌ 削除対象のユーザーを指定してください。\n使用例: `!purge_user @ユーザー名` または `!purge_user ユーザーID`")
             return
+
+        if mode not in ("scan", "index"):
+            await ctx.send("❌ mode には `scan` または `index` を指定してください。")
+            return
+        if mode == "index" and self.bot.author_index is None:
+            await ctx.send("❌ 投稿者インデックスが無効なため `index` モードは使用できません。")
+            return
         
         # ユーザー入力からユーザーを特定
         target_user = None
@@ -855,6 +1045,8 @@ class Gemini(commands.Cog):
         warning_text += "**⚠️ 警告: この操作はサーバー内のすべてのチャンネルに影響します！⚠️**\n"
         warning_text += "**⚠️ この処理はAPIレート制限により非常に時間がかかる場合があります！⚠️**\n"
         warning_text += "**⚠️ 大量のメッセージを削除する場合、複数回の処理が必要になることがあります！⚠️**\n"
+        if mode == "index":
+            warning_text += "**⚠️ indexモードでは投稿者インデックスに記録されていないメッセージは削除されません！⚠️**\n"
         warning_text += f"確認するには✅リアクションを、キャンセルするには❌リアクションを付けてください。\n"
         warning_text += f"30秒後にタイムアウトします。"
         
@@ -874,241 +1066,53 @@ class Gemini(commands.Cog):
             
             if str(reaction.emoji) == "✅":
                 status_msg = await ctx.send(f"🔍 {target_user.display_name}のメッセージを検索中...")
-                
-                def is_user(m):
-                    return m.author.id == target_user.id
-                
-                deleted_count = 0
-                error_channels = []
-                rate_limited_count = 0
-                failed_messages = []  # 削除に失敗したメッセージを記録
-                
-                # レート制限対応のための削除関数
-                async def delete_with_rate_limit(channel, messages, retry_count=0):
-                    nonlocal deleted_count, rate_limited_count, failed_messages
-                    
-                    if not messages:
-                        return
-                        
-                    # 一括削除（14日以内のメッセージのみ）
-                    two_weeks_ago = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=14)
-                    recent_messages = [m for m in messages if m.created_at > two_weeks_ago]
-                    old_messages = [m for m in messages if m.created_at <= two_weeks_ago]
-                    
-                    # 最近のメッセージは一括削除
-                    if recent_messages:
-                        try:
-                            # 一度に削除するメッセージ数を制限（100件まで）
-                            for i in range(0, len(recent_messages), 100):
-                                batch = recent_messages[i:i+100]
-                                await channel.delete_messages(batch)
-                                deleted_count += len(batch)
-                                # 一括削除後の待機（レート制限対策）
-                                await asyncio.sleep(1.5)
-                        except discord.errors.HTTPException as e:
-                            if e.code == 429:  # レート制限
-                                rate_limited_count += 1
-                                retry_after = e.retry_after if hasattr(e, 'retry_after') else 2
-                                await status_msg.edit(content=f"⏳ レート制限に達しました。{retry_after:.1f}秒待機中... (削除済み: {deleted_count}件)")
-                                await asyncio.sleep(retry_after + 0.5)  # 余裕を持って待機
-                                # 個別に削除を試みる
-                                for msg in recent_messages:
-                                    await delete_single_message(channel, msg)
-                            else:
-                                self.logger.error(f"Error bulk deleting messages: {e}")
-                                # エラーが発生した場合、個別に削除を試みる
-                                for msg in recent_messages:
-                                    await delete_single_message(channel, msg)
-                    
-                    # 古いメッセージは個別に削除
-                    for msg in old_messages:
-                        await delete_single_message(channel, msg)
-                
-                # 個別メッセージ削除関数
-                async def delete_single_message(channel, message, retry_count=0):
-                    nonlocal deleted_count, rate_limited_count, failed_messages
-                    
-                    max_retries = 5  # 最大再試行回数
-                    
-                    try:
-                        await message.delete()
-                        deleted_count += 1
-                        # 個別削除後の待機（レート制限対策）
-                        await asyncio.sleep(0.8)
-                    except discord.errors.HTTPException as e:
-                        if e.code == 429:  # レート制限
-                            rate_limited_count += 1
-                            retry_after = e.retry_after if hasattr(e, 'retry_after') else 1
-                            # 指数バックオフ（リトライ回数に応じて待機時間を増加）
-                            backoff = min(retry_after * (1.5 ** min(rate_limited_count, 5)), 15)
-                            await status_msg.edit(content=f"⏳ レート制限に達しました。{backoff:.1f}秒待機中... (削除済み: {deleted_count}件)")
-                            await asyncio.sleep(backoff)
-                            
-                            # 再試行
-                            if retry_count < max_retries:
-                                await delete_single_message(channel, message, retry_count + 1)
-                            else:
-                                # 最大再試行回数に達した場合は記録
-                                failed_messages.append((channel, message))
-                        elif e.code != 404:  # 404はメッセージが既に削除されている場合
-                            self.logger.error(f"Error deleting message: {e}")
-                            if retry_count < max_retries:
-                                # 他のエラーでも再試行
-                                await asyncio.sleep(2)  # エラー後は長めに待機
-                                await delete_single_message(channel, message, retry_count + 1)
-                            else:
-                                # 最大再試行回数に達した場合は記録
-                                failed_messages.append((channel, message))
-                    except Exception as e:
-                        self.logger.error(f"Unexpected error deleting message: {e}")
-                        if retry_count < max_retries:
-                            await asyncio.sleep(2)
-                            await delete_single_message(channel, message, retry_count + 1)
-                        else:
-                            failed_messages.append((channel, message))
-                
-                # 失敗したメッセージの再試行関数
-                async def retry_failed_messages():
-                    nonlocal failed_messages
-                    
-                    if not failed_messages:
-                        return
-                        
-                    await status_msg.edit(content=f"🔄 削除に失敗したメッセージを再試行中... ({len(failed_messages)}件)")
-                    
-                    # 失敗したメッセージのコピーを作成（処理中にリストが変更される可能性があるため）
-                    messages_to_retry = failed_messages.copy()
-                    failed_messages = []
-                    
-                    # 長めの間隔を空けて再試行
-                    for channel, message in messages_to_retry:
-                        try:
-                            await message.delete()
-                            deleted_count += 1
-                            await asyncio.sleep(1.2)  # 再試行時は長めの間隔
-                        except Exception:
-                            # 再試行でも失敗した場合は記録
-                            failed_messages.append((channel, message))
-                    
-                    # 再試行後も失敗したメッセージがある場合
-                    if failed_messages:
-                        await asyncio.sleep(5)  # 長めの待機
-                        await retry_failed_messages()  # 再帰的に再試行
-                
-                # サーバー全体の処理
                 progress_msg = await ctx.send("0% 完了")
-                
-                # テキストチャンネル、スレッド、ボイスチャットを取得
-                text_channels = ctx.guild.text_channels
-                threads = [thread for channel in text_channels for thread in channel.threads]
-                voice_channels = ctx.guild.voice_channels
-                
-                total_channels = len(text_channels) + len(threads) + len(voice_channels)
-                processed_channels = 0
-                
-                # 各チャンネルでの処理
-                for channel in text_channels + threads + voice_channels:
-                    try:
-                        # チャンネルにアクセスできるか確認
-                        if not channel.permissions_for(ctx.guild.me).manage_messages:
-                            error_channels.append(f"{channel.name} (権限不足)")
-                            continue
-                            
-                        # 進捗状況を更新
-                        processed_channels += 1
-                        progress = int((processed_channels / total_channels) * 100)
-                        channel_type = "スレッド" if isinstance(channel, discord.Thread) else "ボイスチャット" if isinstance(channel, discord.VoiceChannel) else "チャンネル"
-                        await progress_msg.edit(content=f"{progress}% 完了 - {channel.name} ({channel_type})を処理中... (削除済み: {deleted_count}件)")
-                        
-                        # 複数回のスキャンを行う
-                        scan_count = 0
-                        max_scans = 10  # 最大スキャン回数
-                        found_messages = True  # 初回はスキャンを実行するためTrue
-                        oldest_message_id = None
-                        
-                        while found_messages and scan_count < max_scans and (limit <= 0 or deleted_count < limit):
-                            scan_count += 1
-                            found_messages = False
-                            
-                            # メッセージ取得
-                            messages_to_delete = []
-                            
-                            # スキャン（1回あたり最大5000件）
-                            scan_limit = 5000
-                            
-                            # 前回のスキャンの最古メッセージより前を検索
-                            kwargs = {}
-                            if oldest_message_id:
-                                kwargs['before'] = discord.Object(id=oldest_message_id)
-                            
-                            message_count = 0
-                            async for msg in channel.history(limit=scan_limit, **kwargs):
-                                message_count += 1
-                                
-                                # 最古のメッセージIDを更新
-                                if message_count == scan_limit:
-                                    oldest_message_id = msg.id
-                                    
-                                if is_user(msg):
-                                    found_messages = True
-                                    messages_to_delete.append(msg)
-                                    
-                                    # バッチサイズに達したら削除実行
-                                    if len(messages_to_delete) >= 20:
-                                        await delete_with_rate_limit(channel, messages_to_delete)
-                                        messages_to_delete = []
-                                        # 進捗更新
-                                        await progress_msg.edit(content=f"{progress}% 完了 - {channel.name}を処理中... (スキャン{scan_count}/{max_scans}, 削除済み: {deleted_count}件)")
-                                
-                                # 指定した制限に達した場合は終了
-                                if limit > 0 and deleted_count >= limit:
-                                    break
-                            
-                            # 残りのメッセージを削除
-                            if messages_to_delete:
-                                await delete_with_rate_limit(channel, messages_to_delete)
-                                
-                            # メッセージが見つからなかった場合や、スキャン上限に達しなかった場合は終了
-                            if message_count < scan_limit:
-                                break
-                                
-                            # スキャン間の待機
-                            await asyncio.sleep(1)
-                        
-                    except discord.Forbidden:
-                        error_channels.append(f"{channel.name} (権限不足)")
-                    except Exception as e:
-                        self.logger.error(f"Error purging messages in {channel.name}: {e}")
-                        error_channels.append(f"{channel.name} (エラー: {str(e)})")
-                
+
+                async def report_progress(progress: PurgeProgress):
+                    percent = int(progress.done_channels / progress.total_channels * 100) if progress.total_channels else 100
+                    active = ", ".join(sorted(progress.active)[:3])
+                    await progress_msg.edit(
+                        content=f"{percent}% 完了 - {active}を処理中... "
+                                f"(スキャン済み: {progress.scanned}件, 削除済み: {progress.deleted}件)")
+
+                if mode == "index":
+                    # 投稿者インデックスから対象のメッセージIDを調べ、履歴をスキャンせずに削除する
+                    targets = await self._indexed_purge_targets(ctx.guild, target_user.id)
+                    result = await self.purge_engine.delete_targets(targets, limit, on_progress=report_progress)
+                else:
+                    # テキストチャンネル、スレッド、ボイスチャットを取得
+                    text_channels = ctx.guild.text_channels
+                    threads = [thread for channel in text_channels for thread in channel.threads]
+                    voice_channels = ctx.guild.voice_channels
+
+                    # チャンネルを並行してスキャンし、共通のレート制限の範囲で削除する
+                    result = await self.purge_engine.run(
+                        text_channels + threads + voice_channels, target_user.id, limit, on_progress=report_progress)
+
                 # 進捗メッセージを削除
                 await progress_msg.delete()
-                
-                # 失敗したメッセージを再試行
-                if failed_messages:
-                    await retry_failed_messages()
-                
+
                 # 結果報告
                 limit_text = "すべての" if limit >= 10000000 else f"{limit}件の"
-                result_msg = f"✅ {target_user.display_name}の{limit_text}メッセージを{deleted_count}件削除しました。"
-                
-                if rate_limited_count > 0:
-                    result_msg += f"\n⚠️ 処理中に{rate_limited_count}回のレート制限が発生しました。"
-                
-                if failed_messages:
-                    result_msg += f"\n⚠️ {len(failed_messages)}件のメッセージを削除できませんでした。再試行しましたが失敗しました。"
-                
+                result_msg = f"✅ {target_user.display_name}の{limit_text}メッセージを{result.deleted}件削除しました。"
+                result_msg += f" ({result.elapsed:.0f}秒)"
+
+                if result.rate_limited > 0:
+                    result_msg += f"\n⚠️ 処理中に{result.rate_limited}回のレート制限が発生しました。"
+
+                if result.missing:
+                    result_msg += f"\nℹ️ {result.missing}件はすでに削除されていました。"
+
+                if result.failed:
+                    result_msg += f"\n⚠️ {result.failed}件のメッセージを削除できませんでした。再試行しましたが失敗しました。"
+
+                error_channels = result.error_channels
                 if error_channels:
                     result_msg += f"\n⚠️ 以下のチャンネルでエラーが発生しました：\n" + "\n".join(error_channels[:10])
                     if len(error_channels) > 10:
                         result_msg += f"\n...他{len(error_channels) - 10}チャンネル"
-                
-                # 削除が少ない場合の追加メッセージ
-                if deleted_count < 10000 and limit >= 10000000:
-                    result_msg += f"\n\n💡 削除されたメッセージが予想より少ない場合は、コマンドを複数回実行してみてください。"
-                    result_msg += f"\n💡 Discordの仕様により、非常に古いメッセージは一度に検出できない場合があります。"
-                
-                await status_msg.edit(content=result_msg)
+
+                await self.dispatcher.edit(status_msg, result_msg)
             else:
                 await ctx.send("操作をキャンセルしました。")
                 
@@ -1,4 +1,7 @@
+import asyncio
+import functools
 import re
+import time
 from typing import Literal, Optional
 
 import discord
@@ -8,17 +11,23 @@ from discord.ext import commands
 
 from Config import settings
 from src import Entities, Session
+from src.ChannelIndex import ChannelIndex
+from src.ForwardQueue import ForwardQueue
+from src.GuildSnapshot import GuildSnapshot, command_tree_hash
+from src.ReactionTracker import ReactionTracker
 from src.Repositories import DatabaseRepository
+from src.StateStore import StateStore
 
 
 class RoleOperation(commands.Cog):
     def __init__(self, bot, logger):
 
-        self.members = []
-        self.public_channels = []
-        self.private_channels = []
+        self.channel_index = ChannelIndex()
+        self.infant_role_id = None
         self.bot = bot
         self.logger = logger
+        self.dispatcher = bot.dispatcher
+        self.role_index = bot.role_index
         self.log_channel_id = settings.LOG_CHANNEL_ID
         self.gakubuchi_channel_id = settings.GAKUBUCHI_CHANNEL_ID
         self.minna_bunko_channel_id = settings.MINNA_BUNKO_CHANNEL_ID
@@ -30,6 +39,11 @@ class RoleOperation(commands.Cog):
         self.guild_id = settings.GUILD_ID
         self.guild = None
         self.history = []
+        self.snapshot = GuildSnapshot(StateStore(settings.STATE_DIR, "guild_snapshot"))
+        self.command_tree_state = StateStore(settings.STATE_DIR, "command_tree")
+        self.reconcile_task: Optional[asyncio.Task] = None
+        self.forward_queue = ForwardQueue(self.dispatcher, self.logger)
+        self.reaction_tracker = ReactionTracker(StateStore(settings.STATE_DIR, "forwarded_reactions"), self.logger)
         self.emoji_channel_map = {
             '🖼️': self.gakubuchi_channel_id,
             'minna_bunko': self.minna_bunko_channel_id,
@@ -38,39 +52,60 @@ class RoleOperation(commands.Cog):
 
     @commands.Cog.listener()
     async def on_ready(self):
+        # on_ready は再接続（再 IDENTIFY）のたびに呼ばれ、Guild オブジェクトも作り直されるので毎回取り直す
+        first_ready = self.guild is None
         self.logger.info(f"Connecting to the channel")
         self.guild = self.bot.get_guild(self.guild_id)
-        await self.bot.tree.sync(guild=discord.Object(id=self.guild_id))
-        self.logger.info(f'Connected to {self.guild.name}')
 
-        async for member in self.guild.fetch_members(limit=None):
-            if not member.bot and [role for role in member.roles if role.name != 'Parent']:
-                self.members.append(member)
-
-        for channel in self.guild.text_channels:
-            if channel.overwrites == {}:
-                self.public_channels.append(channel)
-            else:
-                self.private_channels.append(channel)
-
-            # async for message in channel.history(limit=10):
-            #     disc_msg: discord.Message = message
-            #     msg: MessagePayload = MessagePayload(
-            #         member_id=disc_msg.author.id,
-            #         channel_id=disc_msg.channel.id,
-            #         msg_id=disc_msg.id,
-            #         created_at=disc_msg.created_at.astimezone(timezone.utc).replace(tzinfo=None)
-            #     )
-            #     async for session in Session.get_db_session():
-            #         self.logger.info(f"Saving message: {msg.dict()}")
-            #         repo = DatabaseRepository(Entities.Message, session)
-            #         await repo.create(msg.dict())
-            #         self.logger.info(f"Message saved: {msg.dict()}")
+        # 初回は前回のスナップショットで索引を復元し、メンバー一覧はバックグラウンドで取得して差分を反映する
+        restored = first_ready and self.snapshot.restore(self.guild_id, self.role_index, self.channel_index)
+        # チャンネルは接続時に全件届いているのでその場で分類し直す
+        self.channel_index.rebuild(self.guild.text_channels)
+        self.infant_role_id = self._role_id('Infant')
 
         self.log_channel: Messageable = self.guild.get_channel(self.log_channel_id)
         self.gakubuchi_channel: Messageable = self.guild.get_channel(self.gakubuchi_channel_id)
         self.minna_bunko_channel: Messageable = self.guild.get_channel(self.minna_bunko_channel_id)
         self.freememo_channel: Messageable = self.guild.get_channel(self.freememo_channel_id)
+        self.logger.info(f'Connected to {self.guild.name}'
+                         + (f' (restored {len(self.role_index)} members from snapshot)' if restored else ''))
+
+        if self.reconcile_task is not None and not self.reconcile_task.done():
+            # 古い Guild のメンバーを取得している途中なら、新しい Guild で取り直す
+            self.reconcile_task.cancel()
+        self.reconcile_task = asyncio.create_task(self._reconcile_members(self.guild))
+        await self._sync_commands_if_changed()
+
+    async def _reconcile_members(self, guild: discord.Guild):
+        """ゲートウェイからメンバー一覧を取得して索引を作り直し、スナップショットを保存する"""
+        started = time.monotonic()
+        try:
+            await guild.chunk()
+        except Exception as e:
+            self.logger.error(f"Error fetching members: {e}")
+            return
+        self.role_index.rebuild(guild.members)
+        self.snapshot.save(self.guild_id, self.role_index, self.channel_index)
+        self.logger.info(f"Reconciled {len(self.role_index)} members in {time.monotonic() - started:.1f}s")
+
+    async def _sync_commands_if_changed(self):
+        """コマンド定義が前回の同期から変わっている場合だけツリーを同期する"""
+        guild = discord.Object(id=self.guild_id)
+        digest = command_tree_hash(self.bot.tree, guild)
+        if self.command_tree_state.load(default={}).get("hash") == digest:
+            self.logger.info("Command tree is unchanged, skipping sync")
+            return
+        await self.bot.tree.sync(guild=guild)
+        self.command_tree_state.save({"hash": digest})
+        self.logger.info("Command tree synced")
+
+    def cog_unload(self):
+        self.forward_queue.close()
+        self.reaction_tracker.close()
+        if self.reconcile_task is not None and not self.reconcile_task.done():
+            self.reconcile_task.cancel()
+        if self.guild is not None:
+            self.snapshot.save(self.guild_id, self.role_index, self.channel_index)
 
     @app_commands.command(name="getallmessages", description="Getting all messages")
     @app_commands.guilds(settings.GUILD_ID)
@@ -80,41 +115,69 @@ class RoleOperation(commands.Cog):
         async for session in Session.get_db_session():
             self.logger.info(f"Getting all messages")
             repo = DatabaseRepository(Entities.Message, session)
-            messages = await repo.get_all()
-            disc_msg = await self.guild.get_channel(messages[0].channel_id).fetch_message(messages[0].msg_id)
-            await interaction.followup.send(f"Messages: {disc_msg.content}")
+            messages = await repo.list(limit=10, newest_first=True)
+            if not messages:
+                await interaction.followup.send("No messages found.")
+                return
+            resolved = await self.bot.message_resolver.resolve((msg.channel_id, msg.msg_id) for msg in messages)
+            lines = [f"{resolved[msg.msg_id].author_name}: {resolved[msg.msg_id].content[:150]}"
+                     if msg.msg_id in resolved else f"(deleted) Message ID: {msg.msg_id}"
+                     for msg in messages]
+            await interaction.followup.send("Messages:\n" + "\n".join(lines))
 
     @commands.Cog.listener()
     async def on_member_join(self, member):
         self.logger.info(f'{member.name} joined the server')
-        await self.log_channel.send(f'{member.mention} joined the server! Hello Baby!')
+        if member.guild.id == self.guild_id:
+            self.role_index.add_member(member)
+        await self.dispatcher.send(self.log_channel, f'{member.mention} joined the server! Hello Baby!')
         await self.assign_role(member.guild, member, 'Infant')
 
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        if after.guild.id == self.guild_id:
+            self.role_index.update_member(before, after)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        if member.guild.id == self.guild_id:
+            self.role_index.remove_member(member.id)
+
     @commands.Cog.listener()
     async def on_message(self, message):
-        author, content = message.author, message.content
-        sanitized_content = re.sub("<@\d+>", "", content).strip()
-        
-        # DMの場合は処理をスキップ（Guild内のメッセージのみ処理）
-        if not message.guild:
+        # DMや対象外のチャンネルはすぐに抜ける（ほとんどのメッセージはここで終わる）
+        if not message.guild or message.author.bot or not self.channel_index.is_public(message.channel.id):
+            return
+        author = message.author
+        if self.infant_role_id is None:
+            self.infant_role_id = self._role_id('Infant')
+        # メッセージに含まれるメンバーのロールが最新（索引は再起動直後にスナップショットのままのことがある）
+        if self.infant_role_id is None or author.get_role(self.infant_role_id) is None:
+            return
+        if not re.sub(r"<@\d+>", "", message.content).strip():
             return
-            
-        # メッセージがサーバー内の場合のみroles属性にアクセス
-        member_roles = [role.name for role in author.roles]
-        public_channels_ids = [channel.id for channel in self.public_channels]
-
-        is_message_empty = len(sanitized_content) == 0
-        is_author_bot = author.bot
-        is_in_public_channels = message.channel.id in public_channels_ids
-        is_author_infant = "Infant" in member_roles
 
         # TODO: use embed
-        if not is_message_empty and not is_author_bot and is_in_public_channels and is_author_infant:
-            self.logger.info(f'{author.display_name} said {message.content}')
-            await self.assign_role(message.guild, author, 'Toddler')
-            await self.remove_role(message.guild, author, 'Infant')
-            await self.log_channel.send(
-                f'{author.mention} said their first word! They are Toddler now! {message.jump_url}')
+        self.logger.info(f'{author.display_name} said {message.content}')
+        await self.assign_role(message.guild, author, 'Toddler')
+        await self.remove_role(message.guild, author, 'Infant')
+        await self.dispatcher.send(
+            self.log_channel, f'{author.mention} said their first word! They are Toddler now! {message.jump_url}')
+
+    @commands.Cog.listener()
+    async def on_guild_channel_create(self, channel):
+        if channel.guild.id == self.guild_id:
+            self.channel_index.update(channel)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before, after):
+        if after.guild.id == self.guild_id:
+            self.channel_index.update(after)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        if channel.guild.id == self.guild_id:
+            self.channel_index.remove(channel.id)
 
     @commands.Cog.listener()
     @commands.has_any_role("Parent", "Toddler")
@@ -123,13 +186,33 @@ class RoleOperation(commands.Cog):
         if emoji_name not in self.emoji_channel_map:
             return
 
-        self.logger.info(f"Emoji {emoji_name} is reacted")
+        self.reaction_tracker.added(payload.message_id, emoji_name)
+        # 転送済みのメッセージへのリアクションはメッセージを取得せずに終える
+        if not self.reaction_tracker.claim(payload.message_id, emoji_name):
+            return
+
+        channel_destination = self.guild.get_channel(self.emoji_channel_map[emoji_name])
+        if channel_destination is None:
+            self.logger.warning(f"Destination channel for {emoji_name} not found")
+            self.reaction_tracker.release(payload.message_id, emoji_name)
+            return
+        self.logger.info(f"Emoji {emoji_name} is reacted, forwarding to {channel_destination.name}")
+        # メッセージの取得と送信は転送キューのワーカーで行い、イベント処理を止めない
+        self.forward_queue.enqueue(
+            channel_destination, payload.message_id, functools.partial(self._prepare_forward, payload, emoji_name),
+            release=functools.partial(self.reaction_tracker.release, payload.message_id, emoji_name))
+
+    async def _prepare_forward(self, payload: RawReactionActionEvent, emoji_name: str):
+        """転送するメンションと埋め込みを作る（転送しない場合は None）"""
         channel_reacted = self.guild.get_channel_or_thread(payload.channel_id)
         if channel_reacted is None:
             self.logger.warning(f"Channel/Thread {payload.channel_id} not found")
-            return
-            
-        msg_reacted: Message = await channel_reacted.fetch_message(payload.message_id)
+            return None
+
+        try:
+            msg_reacted: Message = await channel_reacted.fetch_message(payload.message_id)
+        except discord.NotFound:
+            return None
 
         reaction_count = 0
         for reaction in msg_reacted.reactions:
@@ -140,8 +223,9 @@ class RoleOperation(commands.Cog):
             else:
                 if reaction.emoji.name == emoji_name:
                     reaction_count = reaction.count
-        if reaction_count > 1:
-            return
+        # 起動中に見ていない（以前から付いていた）リアクションがあれば、最初のリアクションではないので転送しない
+        if reaction_count > self.reaction_tracker.count(payload.message_id, emoji_name):
+            return None
 
         desc = msg_reacted.content if f"**{msg_reacted.content}**" else ""
         embed: discord.Embed = discord.Embed(
@@ -150,20 +234,24 @@ class RoleOperation(commands.Cog):
             description=desc,
             color=0x00ff00,
         )
-        embed.set_author(name=msg_reacted.author.display_name, icon_url=msg_reacted.author.avatar.url)
+        embed.set_author(name=msg_reacted.author.display_name, icon_url=msg_reacted.author.display_avatar.url)
         embed.set_footer(text=f"Collected by {payload.member.display_name}")
         if msg_reacted.attachments:
             embed.set_image(url=msg_reacted.attachments[0].url)
-        channel_destination = self.guild.get_channel(self.emoji_channel_map[emoji_name])
-        self.logger.info(f"Sending the message to {channel_destination.name}")
-        await channel_destination.send(f"{msg_reacted.author.mention}", embed=embed)
+        return msg_reacted.author.mention, embed
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_remove(self, payload: RawReactionActionEvent):
+        emoji_name = str(payload.emoji.name)
+        if emoji_name in self.emoji_channel_map:
+            self.reaction_tracker.removed(payload.message_id, emoji_name)
 
     @app_commands.command(name="shutdown", description="Shutting down the bot.")
     @app_commands.guilds(settings.GUILD_ID)
     @app_commands.default_permissions(administrator=True)
     async def shutdown(self, interaction: discord.Interaction):
         self.logger.info(f"Shutting down the bot")
-        await self.log_channel.send(f"Shutting down the bot")
+        await self.dispatcher.send(self.log_channel, f"Shutting down the bot")
         await self.bot.close()
 
     @commands.command()
@@ -207,6 +295,10 @@ class RoleOperation(commands.Cog):
             self.logger.info(f"Synced the tree to {ret}/{len(guilds)}.")
             await ctx.send(f"Synced the tree to {ret}/{len(guilds)}.")
 
+    def _role_id(self, role_name) -> Optional[int]:
+        role = discord.utils.get(self.guild.roles, name=role_name) if self.guild else None
+        return role.id if role else None
+
     @staticmethod
     async def remove_role(guild, member, role_name):
         role = discord.utils.get(guild.roles, name=role_name)
@@ -2,9 +2,18 @@ import discord
 from discord.ext import commands
 
 from Config import settings
+from src import Session
+from src.AuthorIndex import AuthorIndex
+from src.Cogs.Archive import Archive
 from src.Cogs.Gemini import Gemini
 from src.Cogs.RoleOperation import RoleOperation
+from src.Dispatcher import OutboundDispatcher
 from src.Logger import Logger
+from src.MessageResolver import MessageResolver
+from src.Migrate import migrate_tables
+from src.RoleIndex import RoleIndex
+from src.VectorIndex import create_vector_index
+from src.WriteBehind import WriteBehindBuffer
 
 
 class DiscordBot(commands.Bot):
@@ -18,16 +27,48 @@ class DiscordBot(commands.Bot):
         intents.message_content = True
         intents.members = True
 
-        super().__init__(command_prefix, intents=intents)
+        # メンバー一覧は接続後にバックグラウンドで取得する（起動を待たせない）
+        super().__init__(command_prefix, intents=intents, chunk_guilds_at_startup=False)
 
         logger_factory = Logger('discord')
         self.logger = logger_factory.get_logger()
+        self.dispatcher = OutboundDispatcher(self.logger)
+        self.vector_index = create_vector_index()
+        self.role_index = RoleIndex()
+        self.message_resolver = MessageResolver(
+            self, self.logger, max_size=settings.MESSAGE_RESOLVER_CACHE_SIZE, ttl=settings.MESSAGE_RESOLVER_TTL)
+        self.message_writer = None
+        if settings.get_db_url():
+            self.message_writer = WriteBehindBuffer(
+                self.logger,
+                max_batch=settings.WRITE_BEHIND_BATCH_SIZE,
+                flush_interval=settings.WRITE_BEHIND_FLUSH_INTERVAL,
+                max_pending=settings.WRITE_BEHIND_MAX_PENDING,
+            )
+        self.author_index = None
+        if settings.AUTHOR_INDEX_ENABLED and self.message_writer is not None:
+            self.author_index = AuthorIndex(self.message_writer, self.logger)
 
     async def setup_hook(self):
+        if settings.get_db_url():
+            # 書き込みが始まる前に、追加した列・インデックスをデータベースに反映する
+            await migrate_tables()
+        if self.message_writer is not None:
+            self.message_writer.start()
         self.logger.info('Setting up the cogs')
         await self.add_cog(RoleOperation(self, self.logger))
-        await self.add_cog(Gemini(self, self.gemini_api_key, self.logger, self.initial_prompt))
+        gemini = Gemini(self, self.gemini_api_key, self.logger, self.initial_prompt)
+        await self.add_cog(gemini)
+        await self.add_cog(Archive(self, self.logger, gemini.llm))
         self.logger.info('Cogs are set up')
 
+    async def close(self):
+        await super().close()
+        if self.message_writer is not None:
+            # 書き込み待ちのメッセージを保存してから接続を閉じる
+            await self.message_writer.close()
+        if settings.get_db_url():
+            await Session.dispose_engine()
+
     async def get_started(self):
         await self.start(self.discord_api_key)
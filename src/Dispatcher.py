@@ -0,0 +1,204 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+import discord
+from discord.ext import commands
+
+from src.RateLimit import TokenBucket, backoff_delay
+
+MESSAGE_LIMIT = 2000
+FENCE = "```"
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> list[str]:
+    """Split text on line boundaries, closing and reopening code fences that span chunks"""
+    if len(text) <= limit:
+        return [text]
+
+    # 1行だけで上限を超える場合は行の途中で切る（コードブロックの開閉分の余裕を残す）
+    hard_limit = limit - 64
+    lines = []
+    for line in text.split("\n"):
+        while len(line) > hard_limit:
+            lines.append(line[:hard_limit])
+            line = line[hard_limit:]
+        lines.append(line)
+
+    chunks = []
+    current = None
+    fence = None  # コードブロック内にいる間はその開始行
+    for line in lines:
+        closing = f"\n{FENCE}" if fence else ""
+        candidate = line if current is None else f"{current}\n{line}"
+        opens_fence = line.strip().startswith(FENCE) and fence is None
+        reserve = len(f"\n{FENCE}") if fence or opens_fence else 0
+        if current is not None and len(candidate) + reserve > limit:
+            chunks.append(current + closing)
+            current = f"{fence}\n{line}" if fence else line
+        else:
+            current = candidate
+        if line.strip().startswith(FENCE):
+            fence = None if fence else line.strip()
+    if current is not None:
+        chunks.append(current)
+    return chunks
+
+
+def is_unknown_message(error: discord.HTTPException) -> bool:
+    return error.code == 10008 or (error.code == 50035 and "Unknown message" in str(error))
+
+
+@dataclass
+class _Outbound:
+    content: Optional[str]
+    future: asyncio.Future
+    reply_to: Optional[discord.Message] = None
+    fallback_prefix: str = ""
+    merge: bool = True
+    kwargs: dict = field(default_factory=dict)
+
+    @property
+    def mergeable(self) -> bool:
+        return self.merge and self.content is not None and self.reply_to is None and not self.kwargs
+
+
+class OutboundDispatcher:
+    """Per-channel outbound message queues paced to Discord's per-channel and global send limits
+
+    discord.py already retries 429 responses internally; pacing here keeps bursts of
+    multi-chunk output from reaching those limits in the first place.
+    """
+
+    def __init__(self, logger, channel_rate: float = 1.0, channel_burst: int = 5, global_rate: float = 45.0,
+                 max_attempts: int = 3, idle_timeout: float = 60.0) -> None:
+        self.logger = logger
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.max_attempts = max_attempts
+        self.idle_timeout = idle_timeout
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self._queues: dict[int, deque[_Outbound]] = {}
+        self._wakeups: dict[int, asyncio.Event] = {}
+        self._workers: dict[int, asyncio.Task] = {}
+        self._buckets: dict[int, TokenBucket] = {}
+
+    async def send(self, channel, content: Optional[str] = None, *, reply_to: Optional[discord.Message] = None,
+                   fallback_prefix: str = "", code_block: bool = False, merge: bool = True,
+                   **kwargs) -> list[discord.Message]:
+        """Queue content for the channel, split into message-sized chunks; returns the sent messages
+
+        Only the first chunk is sent as a reply; extra keyword arguments (embeds, files...) go with the last one.
+        Pass merge=False for messages that will be edited later so they are never combined with others.
+        """
+        if content is None:
+            chunks = [None]
+        elif code_block:
+            chunks = [f"{FENCE}\n{chunk}\n{FENCE}" for chunk in split_message(content, MESSAGE_LIMIT - 8)]
+        else:
+            chunks = split_message(content)
+
+        loop = asyncio.get_running_loop()
+        items = []
+        for i, chunk in enumerate(chunks):
+            items.append(_Outbound(
+                content=chunk,
+                future=loop.create_future(),
+                reply_to=reply_to if i == 0 else None,
+                fallback_prefix=fallback_prefix if i == 0 else "",
+                merge=merge,
+                kwargs=kwargs if i == len(chunks) - 1 else {},
+            ))
+        self._enqueue(channel, items)
+        return list(await asyncio.gather(*(item.future for item in items)))
+
+    async def reply(self, target, content: Optional[str] = None, **kwargs) -> list[discord.Message]:
+        """Reply to a Message or Context, falling back to a plain send if the original was deleted"""
+        message = target.message if isinstance(target, commands.Context) else target
+        return await self.send(message.channel, content, reply_to=message, **kwargs)
+
+    async def edit(self, message: discord.Message, content: str, code_block: bool = False) -> list[discord.Message]:
+        """Edit message with the first chunk and send any overflow as follow-up messages"""
+        if code_block:
+            chunks = [f"{FENCE}\n{chunk}\n{FENCE}" for chunk in split_message(content, MESSAGE_LIMIT - 8)]
+        else:
+            chunks = split_message(content)
+        await message.edit(content=chunks[0])
+        sent = [message]
+        for chunk in chunks[1:]:
+            sent += await self.send(message.channel, chunk)
+        return sent
+
+    def _enqueue(self, channel, items: list[_Outbound]) -> None:
+        queue = self._queues.setdefault(channel.id, deque())
+        queue.extend(items)
+        self._wakeups.setdefault(channel.id, asyncio.Event()).set()
+        worker = self._workers.get(channel.id)
+        if worker is None or worker.done():
+            self._workers[channel.id] = asyncio.create_task(self._worker(channel))
+
+    def _bucket(self, channel_id: int) -> TokenBucket:
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            bucket = self._buckets[channel_id] = TokenBucket(self.channel_rate, self.channel_burst)
+        return bucket
+
+    async def _worker(self, channel) -> None:
+        queue = self._queues[channel.id]
+        wakeup = self._wakeups[channel.id]
+        while True:
+            if not queue:
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    if not queue:
+                        self._workers.pop(channel.id, None)
+                        return
+                continue
+
+            batch = [queue.popleft()]
+            # 小さなメッセージは上限内でまとめて1通にする
+            while batch[0].mergeable and queue and queue[0].mergeable and \
+                    sum(len(item.content) + 1 for item in batch) + len(queue[0].content) <= MESSAGE_LIMIT:
+                batch.append(queue.popleft())
+
+            head = batch[0]
+            if len(batch) > 1:
+                head = _Outbound(content="\n".join(item.content for item in batch), future=head.future)
+            try:
+                message = await self._deliver(channel, head)
+            except Exception as e:
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                continue
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_result(message)
+
+    async def _deliver(self, channel, item: _Outbound) -> discord.Message:
+        bucket = self._bucket(channel.id)
+        for attempt in range(self.max_attempts):
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                if item.reply_to is not None:
+                    try:
+                        return await item.reply_to.reply(item.content, **item.kwargs)
+                    except discord.HTTPException as e:
+                        if not is_unknown_message(e):
+                            raise
+                        # メッセージが見つからない場合は通常のメッセージとして送信
+                        item.reply_to = None
+                        if item.content is not None:
+                            item.content = f"{item.fallback_prefix}{item.content}"
+                return await channel.send(item.content, **item.kwargs)
+            except discord.HTTPException as e:
+                if e.status != 429 or attempt == self.max_attempts - 1:
+                    raise
+                retry_after = getattr(e, "retry_after", None) or backoff_delay(attempt)
+                self.logger.warning(f"Rate limited sending to {channel.id}, retrying in {retry_after:.1f}s")
+                bucket.penalize(retry_after)
+        raise RuntimeError("unreachable")
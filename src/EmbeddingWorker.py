@@ -0,0 +1,124 @@
+import time
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, Optional, Sequence
+
+from src import Entities, Session
+from src.Embeddings import Embedder
+from src.Repositories import DatabaseRepository
+from src.StateStore import StateStore
+from src.VectorIndex import VectorIndex
+
+# 行ごとの本文。削除済みやテキストのない行は ""、今は取得できなかった行は含めない
+ContentFetcher = Callable[[Sequence[Entities.Message]], Awaitable[dict[uuid.UUID, str]]]
+
+
+class EmbeddingWorker:
+    """Fills Message.embedding for rows that don't have one, in batches, with a resumable checkpoint
+
+    Rows whose message has no text (deleted, attachment-only) are marked as skipped so later passes
+    don't resolve them again. The checkpoint is kept after a pass, so the next one only reads new rows;
+    rows that couldn't be resolved are read again on the next pass, up to max_attempts times.
+    """
+
+    def __init__(self, embedder: Embedder, fetch_contents: ContentFetcher, logger, checkpoint: StateStore,
+                 batch_size: int = 64, vector_index: Optional[VectorIndex] = None, max_attempts: int = 5) -> None:
+        self.embedder = embedder
+        self.fetch_contents = fetch_contents
+        self.logger = logger
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.vector_index = vector_index
+        self.max_attempts = max_attempts
+        # 取得できなかった行ごとの試行回数
+        self._attempts: dict[uuid.UUID, int] = {}
+
+    def _load_state(self) -> tuple[Optional[tuple[datetime, uuid.UUID]], Optional[dict]]:
+        state = self.checkpoint.load()
+        if not state:
+            return None, None
+        return self._decode_cursor(state), state.get("retry")
+
+    @staticmethod
+    def _decode_cursor(state: Optional[dict]) -> Optional[tuple[datetime, uuid.UUID]]:
+        if state is None:
+            return None
+        return datetime.fromisoformat(state["created_at"]), uuid.UUID(state["pk"])
+
+    @staticmethod
+    def _encode_cursor(cursor: Optional[tuple[datetime, uuid.UUID]]) -> Optional[dict]:
+        if cursor is None:
+            return None
+        return {"created_at": cursor[0].isoformat(), "pk": str(cursor[1])}
+
+    def _save_state(self, cursor: Optional[tuple[datetime, uuid.UUID]], retry: Optional[dict]) -> None:
+        if cursor is None:
+            self.checkpoint.clear()
+            return
+        self.checkpoint.save({**self._encode_cursor(cursor), "retry": retry})
+
+    def rewind(self) -> None:
+        """Start the next pass from the oldest row, e.g. after a backfill added rows behind the checkpoint"""
+        self.checkpoint.clear()
+
+    async def run_once(self) -> tuple[int, int]:
+        """Embed one batch; returns (rows scanned, rows embedded)"""
+        cursor, retry = self._load_state()
+        async for session in Session.get_db_session():
+            repo = DatabaseRepository(Entities.Message, session)
+            rows = await repo.list(limit=self.batch_size, after=cursor, embedding=None, embedding_skipped=False)
+            if not rows:
+                if retry is not None:
+                    # 取得できなかった行があれば、次の巡回はその手前から読み直す
+                    self._save_state(self._decode_cursor(retry["after"]), None)
+                # それ以外はチェックポイントを残し、次回はその後に保存された行だけを調べる
+                return 0, 0
+
+            contents = await self.fetch_contents(rows)
+            for row in rows:
+                if row.pk in contents:
+                    self._attempts.pop(row.pk, None)
+                    continue
+                self._attempts[row.pk] = self._attempts.get(row.pk, 0) + 1
+                if self._attempts[row.pk] >= self.max_attempts:
+                    # 何度試しても取得できない行は、埋め込めない行として印を付ける
+                    self.logger.warning(f"EmbeddingWorker: giving up on message {row.channel_id}/{row.msg_id}")
+                    self._attempts.pop(row.pk)
+                    contents[row.pk] = ""
+            targets = [row for row in rows if contents.get(row.pk)]
+            skipped = [row for row in rows if contents.get(row.pk) == ""]
+            vectors = await self.embedder.embed([contents[row.pk] for row in targets])
+
+            await repo.update_many([{"pk": row.pk, "embedding": vector} for row, vector in zip(targets, vectors)])
+            await repo.update_many([{"pk": row.pk, "embedding_skipped": True} for row in skipped])
+            if self.vector_index is not None:
+                self.vector_index.add((row.channel_id, row.msg_id, vector) for row, vector in zip(targets, vectors))
+            if retry is None and len(targets) + len(skipped) < len(rows):
+                # このバッチの手前を覚えておき、巡回の終わりにそこへ戻って取得し直す
+                retry = {"after": self._encode_cursor(cursor)}
+            self._save_state((rows[-1].created_at, rows[-1].pk), retry)
+            return len(rows), len(targets)
+        return 0, 0
+
+    async def run(self, max_batches: Optional[int] = None) -> tuple[int, float]:
+        """Embed until no rows are left; returns (rows embedded, rows per second)"""
+        started = time.monotonic()
+        embedded = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            batch_started = time.monotonic()
+            scanned, count = await self.run_once()
+            if scanned == 0:
+                break
+            batches += 1
+            embedded += count
+            elapsed = time.monotonic() - batch_started
+            self.logger.info(f"Embedded {count}/{scanned} rows in {elapsed:.2f}s ({count / elapsed:.1f} rows/s)")
+
+        elapsed = time.monotonic() - started
+        rate = embedded / elapsed if elapsed else 0.0
+        if embedded:
+            if self.vector_index is not None:
+                self.vector_index.flush()
+            self.logger.info(f"Embedding run finished: {embedded} rows in {elapsed:.1f}s ({rate:.1f} rows/s)")
+        return embedded, rate
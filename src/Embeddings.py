@@ -0,0 +1,85 @@
+import hashlib
+import math
+import re
+from abc import ABC, abstractmethod
+
+import google.generativeai as genai
+
+from Config import settings
+from src.Entities import EMBEDDING_DIM
+from src.LLMScheduler import Priority
+
+
+class Embedder(ABC):
+    """Turns a batch of texts into vectors of `dim` floats"""
+
+    dim: int = EMBEDDING_DIM
+
+    @abstractmethod
+    async def embed(self, texts: list[str], priority: Priority = Priority.BACKGROUND) -> list[list[float]]:
+        ...
+
+
+class HashingEmbedder(Embedder):
+    """Deterministic local stand-in embedder based on hashed character n-grams
+
+    Needs no network or model, so tests and CI get stable vectors where similar texts land close together.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, ngram: int = 2) -> None:
+        self.dim = dim
+        self.ngram = ngram
+
+    def _features(self, text: str) -> list[str]:
+        text = re.sub(r"\s+", " ", text.lower()).strip()
+        if len(text) <= self.ngram:
+            return [text] if text else []
+        return [text[i:i + self.ngram] for i in range(len(text) - self.ngram + 1)]
+
+    def embed_one(self, text: str) -> list[float]:
+        vector = [0.0] * self.dim
+        for feature in self._features(text):
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.dim] += 1.0 if value >> 63 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector))
+        return [x / norm for x in vector] if norm else vector
+
+    async def embed(self, texts: list[str], priority: Priority = Priority.BACKGROUND) -> list[list[float]]:
+        return [self.embed_one(text) for text in texts]
+
+
+class GeminiEmbedder(Embedder):
+    """Gemini embeddings, batched and run through the LLM client's executor and quota
+
+    The Gemini model returns fewer dimensions than the column holds, so vectors are zero-padded;
+    padding with zeros leaves cosine similarity between vectors unchanged.
+    """
+
+    def __init__(self, llm, model: str = "models/embedding-001", dim: int = EMBEDDING_DIM,
+                 task_type: str = "retrieval_document") -> None:
+        self.llm = llm
+        self.model = model
+        self.dim = dim
+        self.task_type = task_type
+
+    async def embed(self, texts: list[str], priority: Priority = Priority.BACKGROUND) -> list[list[float]]:
+        if not texts:
+            return []
+        result = await self.llm.run(
+            genai.embed_content, model=self.model, content=texts, task_type=self.task_type,
+            priority=priority, governor=self.llm.embedding_governor,
+        )
+        return [self._fit(vector) for vector in result["embedding"]]
+
+    def _fit(self, vector: list[float]) -> list[float]:
+        if len(vector) >= self.dim:
+            return list(vector[:self.dim])
+        return list(vector) + [0.0] * (self.dim - len(vector))
+
+
+def create_embedder(llm, task_type: str = "retrieval_document") -> Embedder:
+    """Embedder selected by EMBEDDING_BACKEND"""
+    if settings.EMBEDDING_BACKEND == "hashing":
+        return HashingEmbedder()
+    return GeminiEmbedder(llm, task_type=task_type)
@@ -2,10 +2,12 @@ import uuid
 from datetime import datetime
 
 from pgvector.sqlalchemy import Vector
-from sqlalchemy import BigInteger
+from sqlalchemy import BigInteger, Index, false
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import mapped_column, Mapped
 
+EMBEDDING_DIM = 1536
+
 
 class BaseEntity(DeclarativeBase):
     pk: Mapped[uuid.UUID] = mapped_column(
@@ -26,4 +28,22 @@ class Message(BaseEntity):
     member_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
     channel_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
     msg_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
-    embedding = mapped_column(Vector(1536), nullable=True)
+    embedding = mapped_column(Vector(EMBEDDING_DIM), nullable=True)
+    # 削除済みやテキストのないメッセージは埋め込みを作れないので、再取得しないよう印を付ける
+    embedding_skipped: Mapped[bool] = mapped_column(default=False, server_default=false())
+
+    __table_args__ = (
+        Index("uq_message_msg_id", "msg_id", unique=True),
+        Index("ix_message_channel_id_msg_id", "channel_id", "msg_id"),
+        Index("ix_message_member_id_created_at", "member_id", "created_at"),
+        # (created_at, pk) のキーセットページング用
+        Index("ix_message_created_at_pk", "created_at", "pk"),
+        # 近似最近傍探索用（コサイン距離）
+        Index(
+            "ix_message_embedding_hnsw",
+            "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"embedding": "vector_cosine_ops"},
+        ),
+    )
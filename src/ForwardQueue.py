@@ -0,0 +1,146 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+import discord
+
+from src.Dispatcher import OutboundDispatcher
+from src.RateLimit import backoff_delay
+
+MAX_EMBEDS = 10  # 1メッセージに付けられる埋め込みの上限
+MAX_EMBED_TOTAL = 6000  # 1メッセージの埋め込み全体の文字数の上限
+
+# 転送内容（メンションと埋め込み）を用意する。転送しない場合は None を返す
+Prepare = Callable[[], Awaitable[Optional[tuple[str, discord.Embed]]]]
+
+
+@dataclass
+class _Forward:
+    source_id: int
+    prepare: Prepare
+    release: Optional[Callable[[], None]] = None  # 転送できなかったときに呼ぶ（転送済みの記録を取り消す）
+    settled: bool = False
+
+
+class ForwardQueue:
+    """Delivers forwarded posts through one worker per destination channel
+
+    Listeners only enqueue; fetching the source and building the embed happen in the worker.
+    A source message is queued at most once per destination, and forwards that pile up during
+    a burst are posted together, up to 10 embeds per message. A forward that fails or is dropped
+    at shutdown calls its `release` callback, so it can be tried again later.
+    """
+
+    def __init__(self, dispatcher: OutboundDispatcher, logger, max_attempts: int = 3) -> None:
+        self.dispatcher = dispatcher
+        self.logger = logger
+        self.max_attempts = max_attempts
+        self._queues: dict[int, deque[_Forward]] = {}
+        self._pending: dict[int, set[int]] = {}
+        self._workers: dict[int, asyncio.Task] = {}
+        self._in_flight: dict[int, list[_Forward]] = {}
+        self.sent = 0
+        self.failed = 0
+
+    def enqueue(self, destination, source_id: int, prepare: Prepare,
+                release: Optional[Callable[[], None]] = None) -> bool:
+        """Queue a forward; False if the source message is already queued for this destination"""
+        pending = self._pending.setdefault(destination.id, set())
+        if source_id in pending:
+            return False
+        pending.add(source_id)
+        self._queues.setdefault(destination.id, deque()).append(_Forward(source_id, prepare, release))
+        worker = self._workers.get(destination.id)
+        if worker is None or worker.done():
+            self._workers[destination.id] = asyncio.create_task(self._worker(destination))
+        return True
+
+    async def _worker(self, destination) -> None:
+        queue = self._queues[destination.id]
+        pending = self._pending[destination.id]
+        while queue:
+            batch = [queue.popleft() for _ in range(min(MAX_EMBEDS, len(queue)))]
+            self._in_flight[destination.id] = batch
+            try:
+                prepared = await asyncio.gather(*(item.prepare() for item in batch), return_exceptions=True)
+                forwards = []
+                for item, result in zip(batch, prepared):
+                    if isinstance(result, BaseException):
+                        self.logger.error(f"Error preparing forward of {item.source_id}: {result}")
+                        self._release(item)
+                    elif result is None:
+                        item.settled = True
+                    else:
+                        forwards.append((item, result))
+                await self._deliver(destination, forwards)
+            finally:
+                # キャンセルされた場合も含め、送信できなかった転送は取り消す
+                for item in batch:
+                    self._release(item)
+                    pending.discard(item.source_id)
+                self._in_flight.pop(destination.id, None)
+        self._workers.pop(destination.id, None)
+
+    @staticmethod
+    def _release(item: _Forward) -> None:
+        if item.settled:
+            return
+        item.settled = True
+        if item.release is not None:
+            item.release()
+
+    async def _deliver(self, destination, forwards: list[tuple[_Forward, tuple[str, discord.Embed]]]) -> None:
+        # 埋め込みの合計文字数の上限を超えないようにメッセージを分ける
+        groups: list[list[tuple[_Forward, tuple[str, discord.Embed]]]] = []
+        size = 0
+        for forward in forwards:
+            embed_size = len(forward[1][1])
+            if not groups or size + embed_size > MAX_EMBED_TOTAL:
+                groups.append([])
+                size = 0
+            groups[-1].append(forward)
+            size += embed_size
+
+        for group in groups:
+            mentions = " ".join(dict.fromkeys(mention for _, (mention, _) in group))
+            embeds = [embed for _, (_, embed) in group]
+            for attempt in range(self.max_attempts):
+                try:
+                    await self.dispatcher.send(destination, mentions, embeds=embeds, merge=False)
+                    self.sent += len(group)
+                    for item, _ in group:
+                        item.settled = True
+                    break
+                except (discord.HTTPException, OSError, asyncio.TimeoutError) as e:
+                    # 4xx（429以外）は再試行しても成功しない
+                    status = getattr(e, "status", None)
+                    permanent = status is not None and 400 <= status < 500 and status != 429
+                    if permanent or attempt == self.max_attempts - 1:
+                        self.failed += len(group)
+                        self.logger.error(f"Failed to forward {len(group)} posts to {destination.name}: {e}")
+                        for item, _ in group:
+                            self._release(item)
+                        break
+                    await asyncio.sleep(backoff_delay(attempt))
+
+    def close(self) -> None:
+        dropped = sum(len(queue) for queue in self._queues.values())
+        if dropped:
+            self.logger.warning(f"Dropping {dropped} queued forwards on shutdown")
+        # ワーカーのキャンセルを待たずに、送信されなかった転送をここで取り消す
+        for items in [*self._queues.values(), *self._in_flight.values()]:
+            for item in items:
+                self._release(item)
+        for queue in self._queues.values():
+            queue.clear()
+        for worker in self._workers.values():
+            worker.cancel()
+        self._workers.clear()
+
+    def stats(self) -> dict:
+        return {
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "sent": self.sent,
+            "failed": self.failed,
+        }
@@ -0,0 +1,43 @@
+import hashlib
+import json
+import time
+
+from discord import app_commands
+
+from src.ChannelIndex import ChannelIndex
+from src.RoleIndex import RoleIndex
+from src.StateStore import StateStore
+
+
+class GuildSnapshot:
+    """Member roles and channel classification saved between runs
+
+    Restoring it makes the role and channel indexes usable as soon as the bot connects, before
+    the member list has been requested from the gateway.
+    """
+
+    def __init__(self, store: StateStore) -> None:
+        self.store = store
+
+    def restore(self, guild_id: int, role_index: RoleIndex, channel_index: ChannelIndex) -> bool:
+        state = self.store.load()
+        if not state or state.get("guild_id") != guild_id:
+            return False
+        role_index.load_state(state["members"])
+        channel_index.load_state(state["channels"])
+        return True
+
+    def save(self, guild_id: int, role_index: RoleIndex, channel_index: ChannelIndex) -> None:
+        self.store.save({
+            "guild_id": guild_id,
+            "saved_at": time.time(),
+            "members": role_index.to_state(),
+            "channels": channel_index.to_state(),
+        })
+
+
+def command_tree_hash(tree: app_commands.CommandTree, guild) -> str:
+    """Hash of the application command definitions registered for the guild"""
+    payload = sorted((command.to_dict() for command in tree.get_commands(guild=guild)),
+                     key=lambda command: (command.get("type", 1), command["name"]))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
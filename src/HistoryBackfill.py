@@ -0,0 +1,117 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from datetime import timezone
+from typing import Optional
+
+import discord
+
+from src import Entities, Session
+from src.Models import MessagePayload
+from src.RateLimit import TokenBucket
+from src.Repositories import DatabaseRepository
+from src.StateStore import StateStore
+
+HISTORY_PAGE_SIZE = 100  # channel.history が1リクエストで取得する件数
+
+
+@dataclass
+class BackfillResult:
+    channels: int
+    messages: int
+    failed_channels: int
+    elapsed: float
+
+
+class HistoryBackfill:
+    """Copies channel and thread history into the message table in batches
+
+    The last saved message ID of each channel is checkpointed after every batch, so an
+    interrupted run resumes where it stopped instead of starting over.
+    """
+
+    def __init__(self, logger, checkpoint: StateStore, concurrency: int = 4,
+                 requests_per_second: float = 5.0, batch_size: int = 1000) -> None:
+        self.logger = logger
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.bucket = TokenBucket(requests_per_second, capacity=max(1.0, requests_per_second))
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._positions: dict[str, int] = {}
+
+    async def channels(self, guild: discord.Guild) -> list[discord.abc.Messageable]:
+        """Text channels, voice channel text chats, and the active and archived public threads"""
+        channels: list[discord.abc.Messageable] = [*guild.text_channels, *guild.voice_channels]
+        seen = {channel.id for channel in channels}
+        for thread in guild.threads:
+            if thread.id not in seen:
+                seen.add(thread.id)
+                channels.append(thread)
+        for channel in guild.text_channels:
+            try:
+                await self.bucket.acquire()
+                async for thread in channel.archived_threads(limit=None):
+                    if thread.id not in seen:
+                        seen.add(thread.id)
+                        channels.append(thread)
+            except discord.Forbidden:
+                continue
+        return channels
+
+    async def _save(self, channel_id: int, rows: list[dict]) -> None:
+        async for session in Session.get_db_session():
+            repo = DatabaseRepository(Entities.Message, session)
+            # やり直し時に同じメッセージを再度保存しても重複しないようにする
+            await repo.upsert_many(rows, index_elements=["msg_id"])
+        # 保存できたところまでを記録する
+        self._positions[str(channel_id)] = rows[-1]["msg_id"]
+        self.checkpoint.save(self._positions)
+
+    async def _backfill_channel(self, channel) -> int:
+        last_id = self._positions.get(str(channel.id))
+        after = discord.Object(id=last_id) if last_id else None
+        rows: list[dict] = []
+        saved = 0
+        async with self._semaphore:
+            await self.bucket.acquire()
+            fetched = 0
+            async for message in channel.history(limit=None, after=after, oldest_first=True):
+                fetched += 1
+                if fetched % HISTORY_PAGE_SIZE == 0:
+                    # 次のページを取得する前にトークンを取る
+                    await self.bucket.acquire()
+                rows.append(MessagePayload(
+                    member_id=message.author.id,
+                    channel_id=channel.id,
+                    msg_id=message.id,
+                    created_at=message.created_at.astimezone(timezone.utc).replace(tzinfo=None),
+                ).dict())
+                if len(rows) >= self.batch_size:
+                    await self._save(channel.id, rows)
+                    saved += len(rows)
+                    rows = []
+            if rows:
+                await self._save(channel.id, rows)
+                saved += len(rows)
+        if saved:
+            self.logger.info(f"Backfilled {saved} messages from #{channel.name}")
+        return saved
+
+    async def run(self, guild: discord.Guild, channels: Optional[list] = None) -> BackfillResult:
+        started = time.monotonic()
+        self._positions = self.checkpoint.load(default={})
+        channels = channels if channels is not None else await self.channels(guild)
+
+        results = await asyncio.gather(
+            *(self._backfill_channel(channel) for channel in channels), return_exceptions=True)
+        messages = 0
+        failed = 0
+        for channel, result in zip(channels, results):
+            if isinstance(result, discord.Forbidden):
+                continue
+            if isinstance(result, BaseException):
+                failed += 1
+                self.logger.error(f"Backfill of #{channel.name} failed: {result}")
+                continue
+            messages += result
+        return BackfillResult(len(channels), messages, failed, time.monotonic() - started)
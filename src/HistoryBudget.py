@@ -0,0 +1,88 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+from src.ChatSessions import ChatSessionEntry
+
+SUMMARY_PROMPT = """
+以下はDiscordでの会話履歴です。今後の会話の文脈として使えるよう、
+登場した人物・話題・決まったこと・未解決の質問を箇条書きで簡潔に要約してください（500文字以内）。
+
+会話履歴：
+{transcript}
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate: CJK characters count as one token, other text as four characters per token"""
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def content_role(content: Any) -> str:
+    return content["role"] if isinstance(content, dict) else content.role
+
+
+def content_text(content: Any) -> str:
+    parts = content["parts"] if isinstance(content, dict) else content.parts
+    return "".join(part if isinstance(part, str) else getattr(part, "text", "") for part in parts)
+
+
+class HistoryBudget:
+    """Folds older chat turns into a summary once a session's history exceeds its token budget"""
+
+    def __init__(self, summarize: Callable[[str], Awaitable[str]], logger,
+                 max_tokens: int = 6000, keep_recent_turns: int = 6, pinned_turns: int = 1) -> None:
+        self.summarize = summarize
+        self.logger = logger
+        self.max_tokens = max_tokens
+        self.keep_recent_turns = keep_recent_turns
+        # 先頭のinitial_promptは常に残す
+        self.pinned_turns = pinned_turns
+
+    def estimate(self, history: list) -> int:
+        return sum(estimate_tokens(content_text(content)) for content in history)
+
+    def maybe_compact(self, entry: ChatSessionEntry) -> Optional[asyncio.Task]:
+        """Schedule a background compaction if the session is over budget and none is running"""
+        if entry.summary_task is not None and not entry.summary_task.done():
+            return None
+        if self.estimate(entry.chat.history) <= self.max_tokens:
+            return None
+        entry.summary_task = asyncio.create_task(self._compact(entry))
+        return entry.summary_task
+
+    def _split_point(self, history: list) -> int:
+        cut = max(self.pinned_turns, len(history) - self.keep_recent_turns * 2)
+        # 残す側の履歴がユーザーの発言から始まるように調整
+        while cut < len(history) and content_role(history[cut]) != "user":
+            cut += 1
+        return cut
+
+    async def _compact(self, entry: ChatSessionEntry) -> None:
+        snapshot = list(entry.chat.history)
+        cut = self._split_point(snapshot)
+        older = snapshot[self.pinned_turns:cut]
+        if len(older) < 2:
+            return
+
+        transcript = "\n".join(f"{content_role(content)}: {content_text(content)}" for content in older)
+        try:
+            summary = await self.summarize(SUMMARY_PROMPT.format(transcript=transcript))
+        except Exception as e:
+            self.logger.error(f"Error summarizing chat history: {e}")
+            return
+        if not summary:
+            return
+
+        # 要約中に送信された発言も保持したまま履歴を差し替える
+        async with entry.lock:
+            history = entry.chat.history
+            if history[:cut] != snapshot[:cut]:
+                self.logger.info("Chat history changed during summarization, skipping compaction")
+                return
+            before = self.estimate(history)
+            entry.chat.history = snapshot[:self.pinned_turns] + [
+                {"role": "user", "parts": [f"これまでの会話の要約:\n{summary}"]},
+                {"role": "model", "parts": ["了解しました。この要約を踏まえて会話を続けます。"]},
+            ] + history[cut:]
+            self.logger.info(f"Compacted chat history from ~{before} to ~{self.estimate(entry.chat.history)} tokens")
@@ -0,0 +1,133 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Hashable, Optional
+
+from src.HistoryBudget import content_text, estimate_tokens
+from src.LLMScheduler import LLMScheduler, Priority
+from src.QuotaGovernor import LLMUnavailable, QuotaGovernor, is_retryable
+
+
+def _chunk_text(chunk) -> str:
+    try:
+        return chunk.text
+    except ValueError:
+        # セーフティフィルタ等でテキストを含まないチャンク
+        return ""
+
+
+def _estimate_request_tokens(content, chat=None) -> int:
+    # チャットでは履歴全体が毎回送信される
+    history = chat.history if chat is not None else []
+    return estimate_tokens(str(content)) + sum(estimate_tokens(content_text(turn)) for turn in history)
+
+
+class LLMClient:
+    """Runs blocking Gemini calls on a dedicated, bounded executor with a per-call deadline"""
+
+    def __init__(self, model, logger, max_workers: int = 4, max_concurrency: int = 4, timeout: float = 60.0,
+                 max_background_queue: int = 4, background_max_wait: float = 30.0,
+                 governor: Optional[QuotaGovernor] = None,
+                 embedding_governor: Optional[QuotaGovernor] = None) -> None:
+        self.model = model
+        self.logger = logger
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini")
+        self.scheduler = LLMScheduler(
+            capacity=max_concurrency,
+            max_background_queue=max_background_queue,
+            background_max_wait=background_max_wait,
+        )
+        self.governor = governor or QuotaGovernor()
+        # 埋め込みAPIは生成とは別の枠で制限されるので、生成のRPMを消費しない
+        self.embedding_governor = embedding_governor or QuotaGovernor()
+
+    async def run(self, fn: Callable[..., Any], *args, priority: Priority = Priority.INTERACTIVE,
+                  user_id: Hashable = None, timeout: Optional[float] = None, tokens: int = 0,
+                  governor: Optional[QuotaGovernor] = None, **kwargs) -> Any:
+        """Run fn in the LLM executor under the quota governor
+
+        Raises asyncio.TimeoutError once the deadline passes and LLMUnavailable while Gemini is overloaded.
+        """
+        async def attempt():
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+            # タイムアウトしてもスレッドは止まらないが、呼び出し側はすぐに解放される
+            return await asyncio.wait_for(future, timeout or self.timeout)
+
+        # クォータは実行枠の中で待つので優先度順に割り当てられ、バックオフ中は実行枠を占有しない
+        return await (governor or self.governor).call(
+            attempt, tokens=tokens, slot=lambda: self.scheduler.slot(priority, user_id))
+
+    async def send_message(self, chat, content, priority: Priority = Priority.INTERACTIVE,
+                           user_id: Hashable = None, timeout: Optional[float] = None):
+        return await self.run(chat.send_message, content, priority=priority, user_id=user_id, timeout=timeout,
+                              tokens=_estimate_request_tokens(content, chat))
+
+    async def generate(self, prompt, priority: Priority = Priority.COMMAND,
+                       user_id: Hashable = None, timeout: Optional[float] = None):
+        return await self.run(self.model.generate_content, prompt, priority=priority, user_id=user_id, timeout=timeout,
+                              tokens=_estimate_request_tokens(prompt))
+
+    async def stream_message(self, chat, content, priority: Priority = Priority.INTERACTIVE,
+                             user_id: Hashable = None, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """Yield text chunks as they arrive; the deadline applies to the wait for each chunk
+
+        Failures before the first chunk are retried with backoff; once text has been yielded errors propagate.
+        """
+        tokens = _estimate_request_tokens(content, chat)
+        for attempt in range(self.governor.max_attempts):
+            self.governor.check()
+            called = False
+            started = False
+            try:
+                async with self.scheduler.slot(priority, user_id):
+                    await self.governor.acquire(tokens)
+                    called = True
+                    loop = asyncio.get_running_loop()
+                    queue: asyncio.Queue = asyncio.Queue()
+                    done = object()
+
+                    def produce() -> None:
+                        try:
+                            for chunk in chat.send_message(content, stream=True):
+                                text = _chunk_text(chunk)
+                                if text:
+                                    loop.call_soon_threadsafe(queue.put_nowait, text)
+                        except Exception as e:
+                            loop.call_soon_threadsafe(queue.put_nowait, e)
+                        else:
+                            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+                    loop.run_in_executor(self.executor, produce)
+                    while True:
+                        item = await asyncio.wait_for(queue.get(), timeout or self.timeout)
+                        if item is done:
+                            break
+                        if isinstance(item, Exception):
+                            raise item
+                        started = True
+                        yield item
+            except Exception as e:
+                if not called:
+                    self.governor.breaker.record_abandoned()
+                    raise
+                self.governor.record(e)
+                if started or not is_retryable(e):
+                    raise
+                if attempt == self.governor.max_attempts - 1:
+                    raise LLMUnavailable("Gemini kept failing after retries") from e
+                await self.governor.backoff(attempt)
+                continue
+            except BaseException:
+                # キャンセルや途中での close。テキストを受信できていれば上流は応答している
+                if started:
+                    self.governor.record()
+                else:
+                    self.governor.breaker.record_abandoned()
+                raise
+            self.governor.record()
+            return
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,134 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import AsyncIterator, Hashable, Optional
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # メンション、!gem
+    COMMAND = 1  # check_infant, discuss_topic などの管理コマンド
+    BACKGROUND = 2  # 定期チェック、履歴の要約
+
+
+class LLMQueueFull(Exception):
+    """Raised when background LLM work is dropped under load"""
+
+
+@dataclass
+class _Waiter:
+    future: asyncio.Future
+    user_id: Hashable
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class _WaitStats:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def record(self, wait: float) -> None:
+        self.count += 1
+        self.total += wait
+        self.max = max(self.max, wait)
+
+
+class LLMScheduler:
+    """Grants LLM call slots by priority class, round-robin across users within a class"""
+
+    def __init__(self, capacity: int = 4, max_background_queue: int = 4, background_max_wait: float = 30.0) -> None:
+        self.capacity = capacity
+        self.max_background_queue = max_background_queue
+        self.background_max_wait = background_max_wait
+        self.active = 0
+        self.dropped = 0
+        self._queues: dict[Priority, OrderedDict[Hashable, deque[_Waiter]]] = {
+            priority: OrderedDict() for priority in Priority
+        }
+        self._wait_stats: dict[Priority, _WaitStats] = {priority: _WaitStats() for priority in Priority}
+
+    def depth(self, priority: Optional[Priority] = None) -> int:
+        priorities = Priority if priority is None else [priority]
+        return sum(len(waiters) for p in priorities for waiters in self._queues[p].values())
+
+    async def acquire(self, priority: Priority = Priority.INTERACTIVE, user_id: Hashable = None) -> None:
+        if self.active < self.capacity and self.depth() == 0:
+            self.active += 1
+            self._wait_stats[priority].record(0.0)
+            return
+
+        if priority == Priority.BACKGROUND and self.depth(Priority.BACKGROUND) >= self.max_background_queue:
+            self.dropped += 1
+            raise LLMQueueFull("Background LLM queue is full")
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), user_id)
+        self._queues[priority].setdefault(user_id, deque()).append(waiter)
+        timeout = self.background_max_wait if priority == Priority.BACKGROUND else None
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+        except BaseException as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 枠を得た直後にキャンセルされた場合は次に譲る
+                self.release()
+            else:
+                self._remove(priority, waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.dropped += 1
+                raise LLMQueueFull("Background LLM work waited too long") from None
+            raise
+        self._wait_stats[priority].record(time.monotonic() - waiter.enqueued_at)
+
+    def release(self) -> None:
+        for priority in Priority:
+            users = self._queues[priority]
+            while users:
+                user_id, waiters = next(iter(users.items()))
+                waiter = waiters.popleft()
+                if waiters:
+                    # 同じユーザーの次の依頼は他のユーザーの後に回す
+                    users.move_to_end(user_id)
+                else:
+                    del users[user_id]
+                if not waiter.future.done():
+                    # 枠はそのまま待機中の依頼に引き継ぐ
+                    waiter.future.set_result(None)
+                    return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority = Priority.INTERACTIVE, user_id: Hashable = None) -> AsyncIterator[None]:
+        await self.acquire(priority, user_id)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _remove(self, priority: Priority, waiter: _Waiter) -> None:
+        users = self._queues[priority]
+        waiters = users.get(waiter.user_id)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            return
+        if not waiters:
+            del users[waiter.user_id]
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "capacity": self.capacity,
+            "dropped": self.dropped,
+            "queues": {
+                priority.name: {
+                    "depth": self.depth(priority),
+                    "avg_wait": stats.total / stats.count if stats.count else 0.0,
+                    "max_wait": stats.max,
+                }
+                for priority, stats in self._wait_stats.items()
+            },
+        }
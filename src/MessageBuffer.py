@@ -0,0 +1,98 @@
+import asyncio
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+
+import discord
+
+
+@dataclass(slots=True)
+class BufferedMessage:
+    id: int
+    author_id: int
+    author_name: str
+    author_bot: bool
+    content: str
+
+
+class ChannelMessageBuffer:
+    """Per-channel ring buffer of recent messages, fed by gateway events and backfilled on a cold miss"""
+
+    def __init__(self, capacity: int = 50, max_channels: int = 256) -> None:
+        self.capacity = capacity
+        self.max_channels = max_channels
+        self._channels: OrderedDict[int, deque[BufferedMessage]] = OrderedDict()
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._pending: dict[int, list[BufferedMessage]] = {}
+
+    @staticmethod
+    def _record(message: discord.Message) -> BufferedMessage:
+        return BufferedMessage(
+            id=message.id,
+            author_id=message.author.id,
+            author_name=message.author.display_name,
+            author_bot=message.author.bot,
+            content=message.content,
+        )
+
+    def append(self, message: discord.Message) -> None:
+        # 未取得のチャンネルは初回読み込み時にまとめて取得する
+        buffer = self._channels.get(message.channel.id)
+        if buffer is None:
+            pending = self._pending.get(message.channel.id)
+            if pending is not None:
+                pending.append(self._record(message))
+            return
+        if buffer and buffer[-1].id >= message.id:
+            if any(item.id == message.id for item in buffer):
+                return
+        buffer.append(self._record(message))
+
+    def edit(self, message: discord.Message) -> None:
+        buffer = self._channels.get(message.channel.id)
+        if buffer is None:
+            return
+        for item in buffer:
+            if item.id == message.id:
+                item.content = message.content
+                return
+
+    def delete(self, channel_id: int, message_id: int) -> None:
+        buffer = self._channels.get(channel_id)
+        if buffer is None:
+            return
+        for item in buffer:
+            if item.id == message_id:
+                buffer.remove(item)
+                return
+
+    async def recent(self, channel, limit: int) -> list[BufferedMessage]:
+        """Return up to `limit` recent messages, oldest first"""
+        buffer = self._channels.get(channel.id)
+        if buffer is None:
+            buffer = await self._backfill(channel)
+        self._channels.move_to_end(channel.id)
+        if limit >= len(buffer):
+            return list(buffer)
+        return list(buffer)[-limit:]
+
+    async def _backfill(self, channel) -> deque[BufferedMessage]:
+        lock = self._locks.setdefault(channel.id, asyncio.Lock())
+        async with lock:
+            buffer = self._channels.get(channel.id)
+            if buffer is not None:
+                return buffer
+            # 取得中に届いたメッセージも取りこぼさないよう保留しておく
+            self._pending[channel.id] = []
+            try:
+                records = [self._record(message) async for message in channel.history(limit=self.capacity)]
+            finally:
+                pending = self._pending.pop(channel.id)
+            records.reverse()
+            newest = records[-1].id if records else 0
+            records.extend(item for item in pending if item.id > newest)
+            buffer = deque(records, maxlen=self.capacity)
+            self._channels[channel.id] = buffer
+            while len(self._channels) > self.max_channels:
+                evicted, _ = self._channels.popitem(last=False)
+                self._locks.pop(evicted, None)
+            return buffer
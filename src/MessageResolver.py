@@ -0,0 +1,181 @@
+import asyncio
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+import discord
+
+HISTORY_WINDOW = 100  # channel.history が1リクエストで返す最大件数
+
+
+@dataclass(frozen=True)
+class ResolvedMessage:
+    channel_id: int
+    id: int
+    author_id: int
+    author_name: str
+    content: str
+    jump_url: str
+
+    @classmethod
+    def from_message(cls, message: discord.Message) -> "ResolvedMessage":
+        return cls(message.channel.id, message.id, message.author.id, message.author.display_name,
+                   message.content, message.jump_url)
+
+
+# 削除済み（404）のメッセージを表す目印
+_TOMBSTONE = object()
+
+
+class MessageResolver:
+    """Turns stored (channel_id, msg_id) references into message content in as few requests as possible
+
+    References are grouped by channel. Runs of nearby IDs are read with one history page instead of
+    one fetch per message, and channels are resolved concurrently up to `concurrency`. Results are
+    kept in an LRU with a TTL, and deleted messages are remembered as tombstones.
+    """
+
+    def __init__(self, bot, logger, max_size: int = 2048, ttl: float = 600.0, tombstone_ttl: float = 3600.0,
+                 concurrency: int = 4) -> None:
+        self.bot = bot
+        self.logger = logger
+        self.max_size = max_size
+        self.ttl = ttl
+        self.tombstone_ttl = tombstone_ttl
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._entries: OrderedDict[int, tuple[float, object]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+
+    def _get(self, msg_id: int) -> Optional[object]:
+        entry = self._entries.get(msg_id)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[msg_id]
+            return None
+        self._entries.move_to_end(msg_id)
+        return value
+
+    def _put(self, msg_id: int, value: object) -> None:
+        ttl = self.tombstone_ttl if value is _TOMBSTONE else self.ttl
+        self._entries[msg_id] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(msg_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def is_deleted(self, msg_id: int) -> bool:
+        """True if the message was recently found to be deleted"""
+        return self._get(msg_id) is _TOMBSTONE
+
+    def invalidate(self, msg_id: int) -> None:
+        """Forget a cached message (e.g. after it was edited or deleted)"""
+        self._entries.pop(msg_id, None)
+
+    async def resolve(self, refs: Iterable[tuple[int, int]]) -> dict[int, ResolvedMessage]:
+        """Resolved messages keyed by msg_id; deleted or unreadable messages are left out"""
+        resolved: dict[int, ResolvedMessage] = {}
+        by_channel: dict[int, set[int]] = defaultdict(set)
+        for channel_id, msg_id in refs:
+            cached = self._get(msg_id)
+            if cached is _TOMBSTONE:
+                self.hits += 1
+            elif cached is not None:
+                self.hits += 1
+                resolved[msg_id] = cached
+            else:
+                by_channel[channel_id].add(msg_id)
+        if not by_channel:
+            return resolved
+
+        # ゲートウェイ経由で受け取った最近のメッセージはリクエストなしで使う
+        gateway_cache = {message.id: message for message in self.bot.cached_messages}
+        for channel_id, msg_ids in by_channel.items():
+            for msg_id in list(msg_ids):
+                message = gateway_cache.get(msg_id)
+                if message is not None:
+                    msg_ids.discard(msg_id)
+                    self.hits += 1
+                    resolved[msg_id] = ResolvedMessage.from_message(message)
+                    self._put(msg_id, resolved[msg_id])
+
+        results = await asyncio.gather(
+            *(self._resolve_channel(channel_id, sorted(msg_ids)) for channel_id, msg_ids in by_channel.items()
+              if msg_ids),
+            return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                self.logger.error(f"Error resolving messages: {result}")
+                continue
+            resolved.update(result)
+        return resolved
+
+    async def resolve_one(self, channel_id: int, msg_id: int) -> Optional[ResolvedMessage]:
+        return (await self.resolve([(channel_id, msg_id)])).get(msg_id)
+
+    async def _resolve_channel(self, channel_id: int, msg_ids: list[int]) -> dict[int, ResolvedMessage]:
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            return {}
+        self.misses += len(msg_ids)
+        found: dict[int, ResolvedMessage] = {}
+        async with self._semaphore:
+            try:
+                while msg_ids:
+                    if len(msg_ids) == 1:
+                        msg_ids = await self._fetch_one(channel, msg_ids[0], found)
+                    else:
+                        msg_ids = await self._fetch_window(channel, msg_ids, found)
+            except discord.Forbidden:
+                pass
+        return found
+
+    async def _fetch_one(self, channel, msg_id: int, found: dict[int, ResolvedMessage]) -> list[int]:
+        self.requests += 1
+        try:
+            message = await channel.fetch_message(msg_id)
+        except discord.NotFound:
+            self._put(msg_id, _TOMBSTONE)
+            return []
+        found[msg_id] = ResolvedMessage.from_message(message)
+        self._put(msg_id, found[msg_id])
+        return []
+
+    async def _fetch_window(self, channel, msg_ids: list[int], found: dict[int, ResolvedMessage]) -> list[int]:
+        """Read one history page starting at the smallest ID; returns the IDs it did not cover"""
+        self.requests += 1
+        wanted = set(msg_ids)
+        last_id = None
+        count = 0
+        async for message in channel.history(limit=HISTORY_WINDOW, after=discord.Object(id=msg_ids[0] - 1),
+                                             oldest_first=True):
+            count += 1
+            last_id = message.id
+            if message.id in wanted:
+                found[message.id] = ResolvedMessage.from_message(message)
+                self._put(message.id, found[message.id])
+
+        # ページが最後まで埋まらなければ、それ以降のメッセージは存在しない
+        covered_up_to = last_id if count == HISTORY_WINDOW else None
+        remaining = []
+        for msg_id in msg_ids:
+            if msg_id in found:
+                continue
+            if covered_up_to is None or msg_id <= covered_up_to:
+                self._put(msg_id, _TOMBSTONE)
+            else:
+                remaining.append(msg_id)
+        return remaining
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "requests": self.requests,
+        }
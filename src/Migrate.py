@@ -1,7 +1,6 @@
-from sqlalchemy import Inspector
-from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy import Inspector, text
 
-from Config import settings
+from src import Session
 from src.Entities import BaseEntity
 from src.Logger import Logger
 
@@ -11,14 +10,48 @@ logger = logger_factory.get_logger()
 
 async def migrate_tables() -> None:
     logger.info('Syncing tables')
-    engine = create_async_engine(settings.get_db_url())
+    engine = Session.get_engine()
     async with engine.begin() as conn:
         def get_table_names(sync_conn):
             inspector = Inspector.from_engine(sync_conn)
             return inspector.get_table_names()
 
+        def deduplicate_messages(sync_conn):
+            # msg_id の一意インデックスを作る前に、重複して保存された行を最も古い1件に減らす
+            inspector = Inspector.from_engine(sync_conn)
+            if "message" not in inspector.get_table_names():
+                return
+            if any(index["name"] == "uq_message_msg_id" for index in inspector.get_indexes("message")):
+                return
+            result = sync_conn.execute(text(
+                "DELETE FROM message a USING message b "
+                "WHERE a.msg_id = b.msg_id AND (a.created_at, a.pk) > (b.created_at, b.pk)"))
+            if result.rowcount:
+                logger.info(f'Removed {result.rowcount} duplicate messages')
+
+        def add_missing_columns(sync_conn):
+            # create_all は既存テーブルに列を追加しないため個別に追加する
+            inspector = Inspector.from_engine(sync_conn)
+            ddl = sync_conn.dialect.ddl_compiler(sync_conn.dialect, None)
+            for table in BaseEntity.metadata.sorted_tables:
+                existing = {column["name"] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing:
+                        sync_conn.execute(text(
+                            f"ALTER TABLE {table.name} ADD COLUMN {ddl.get_column_specification(column)}"))
+                        logger.info(f'Added column {table.name}.{column.name}')
+
+        def create_missing_indexes(sync_conn):
+            # create_all は既存テーブルにインデックスを追加しないため個別に作成する
+            for table in BaseEntity.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(sync_conn, checkfirst=True)
+
         tables_before = await conn.run_sync(get_table_names)
+        await conn.run_sync(deduplicate_messages)
         await conn.run_sync(BaseEntity.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
+        await conn.run_sync(create_missing_indexes)
         tables_after = await conn.run_sync(get_table_names)
 
     new_tables = set(tables_after) - set(tables_before)
@@ -0,0 +1,166 @@
+import asyncio
+import os
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+from src.VectorIndex import SearchHit, VectorIndex
+
+ALL_CHANNELS = "all"
+IDS_SUFFIX = ".ids"
+
+# 検索スレッドに渡す、ある時点のシャードの内容（保存済みの行列、ID、未保存のベクトルとID）
+Snapshot = tuple[np.ndarray, np.ndarray, list[np.ndarray], list[tuple[int, int]]]
+
+
+class _Shard:
+    """One memory-mapped matrix of unit vectors plus its (channel_id, msg_id) rows
+
+    Both are raw append-only files, so a flush writes only the new rows and a search can keep
+    reading the arrays it took while more rows are appended.
+    """
+
+    def __init__(self, directory: Path, name: str, dtype: np.dtype, dim: int) -> None:
+        self.vectors_path = directory / f"{name}.{dtype.name}"
+        self.ids_path = directory / f"{name}{IDS_SUFFIX}"
+        self.dtype = dtype
+        self.dim = dim
+        self.vectors = np.zeros((0, dim), dtype=dtype)
+        self.ids = np.zeros((0, 2), dtype=np.int64)
+        self.pending_vectors: list[np.ndarray] = []
+        self.pending_ids: list[tuple[int, int]] = []
+        self.known: Optional[set[int]] = None
+        self._load()
+
+    def _load(self) -> None:
+        row_sizes = {self.vectors_path: self.dim * self.dtype.itemsize, self.ids_path: 2 * 8}
+        rows = min(path.stat().st_size // size if path.exists() else 0 for path, size in row_sizes.items())
+        for path, size in row_sizes.items():
+            # 追記の途中で止まった場合は、両方のファイルに揃っている行までに切り詰める
+            if path.exists() and path.stat().st_size != rows * size:
+                os.truncate(path, rows * size)
+        if rows:
+            self.vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(rows, self.dim))
+            self.ids = np.memmap(self.ids_path, dtype=np.int64, mode="r", shape=(rows, 2))
+
+    def add(self, channel_id: int, msg_id: int, vector: np.ndarray) -> None:
+        if self.known is None:
+            self.known = set(self.ids[:, 1].tolist())
+        if msg_id in self.known:
+            return
+        self.known.add(msg_id)
+        self.pending_vectors.append(vector.astype(self.dtype))
+        self.pending_ids.append((channel_id, msg_id))
+
+    def flush(self) -> None:
+        if not self.pending_ids:
+            return
+        # ベクトルを先に書くので、途中で止まっても _load が揃っている行までに切り詰める
+        for path, array in ((self.vectors_path, np.stack(self.pending_vectors)),
+                            (self.ids_path, np.array(self.pending_ids, dtype=np.int64))):
+            with path.open("ab") as f:
+                f.write(array.tobytes())
+        self.pending_vectors = []
+        self.pending_ids = []
+        self._load()
+
+    def snapshot(self) -> Snapshot:
+        """The shard's current rows; taken on the event loop, where add() and flush() run"""
+        return self.vectors, self.ids, list(self.pending_vectors), list(self.pending_ids)
+
+    @staticmethod
+    def top_k(snapshot: Snapshot, query: np.ndarray, k: int, block_size: int,
+              channel_id: Optional[int] = None) -> tuple[np.ndarray, np.ndarray]:
+        """Scores and (channel_id, msg_id) rows of the best k matches"""
+        vectors, ids, pending_vectors, pending_ids = snapshot
+        ids = np.asarray(ids)
+
+        scores = []
+        for start in range(0, len(vectors), block_size):
+            # float16 の行列もブロック単位で float32 に変換して計算する
+            block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+            scores.append(block @ query)
+        if pending_vectors:
+            scores.append(np.stack(pending_vectors).astype(np.float32) @ query)
+            ids = np.concatenate([ids, np.array(pending_ids, dtype=np.int64)])
+        if not scores:
+            return np.zeros(0, dtype=np.float32), np.zeros((0, 2), dtype=np.int64)
+
+        scores = np.concatenate(scores)
+        if channel_id is not None:
+            mask = ids[:, 0] == channel_id
+            scores, ids = scores[mask], ids[mask]
+        if len(scores) > k:
+            best = np.argpartition(-scores, k)[:k]
+        else:
+            best = np.arange(len(scores))
+        return scores[best], ids[best]
+
+
+class NumpyVectorIndex(VectorIndex):
+    """In-process cosine top-k over memory-mapped float32/float16 matrices, optionally sharded by channel
+
+    A fallback to pgvector for single-node deployments and CI: no database server is needed.
+    """
+
+    ingests_live_messages = True
+
+    def __init__(self, directory: str, dim: int, dtype: str = "float16", shard_by_channel: bool = True,
+                 block_size: int = 65536) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.shard_by_channel = shard_by_channel
+        self.block_size = block_size
+        self._shards: dict[str, _Shard] = {}
+        for path in self.directory.glob(f"*{IDS_SUFFIX}"):
+            name = path.name[:-len(IDS_SUFFIX)]
+            self._shards[name] = _Shard(self.directory, name, self.dtype, dim)
+
+    def _shard_name(self, channel_id: int) -> str:
+        return str(channel_id) if self.shard_by_channel else ALL_CHANNELS
+
+    def _shard(self, name: str) -> _Shard:
+        shard = self._shards.get(name)
+        if shard is None:
+            shard = self._shards[name] = _Shard(self.directory, name, self.dtype, self.dim)
+        return shard
+
+    def _normalize(self, vector: Sequence[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def add(self, items: Iterable[tuple[int, int, Sequence[float]]]) -> None:
+        """Add (channel_id, msg_id, vector) rows; they are searchable at once and persisted by flush()"""
+        for channel_id, msg_id, vector in items:
+            self._shard(self._shard_name(channel_id)).add(channel_id, msg_id, self._normalize(vector))
+
+    def flush(self) -> None:
+        for shard in self._shards.values():
+            shard.flush()
+
+    def __len__(self) -> int:
+        return sum(len(shard.ids) + len(shard.pending_ids) for shard in self._shards.values())
+
+    def _search(self, snapshots: list[Snapshot], vector: Sequence[float], k: int,
+                channel_id: Optional[int]) -> list[SearchHit]:
+        query = self._normalize(vector)
+        hits = []
+        for snapshot in snapshots:
+            scores, ids = _Shard.top_k(snapshot, query, k, self.block_size, channel_id=channel_id)
+            hits += [SearchHit(hit_channel_id, msg_id, score)
+                     for score, (hit_channel_id, msg_id) in zip(scores.tolist(), ids.tolist())]
+        hits.sort(key=lambda hit: hit.score, reverse=True)
+        return hits[:k]
+
+    async def search(self, vector: Sequence[float], k: int, channel_id: Optional[int] = None) -> list[SearchHit]:
+        if channel_id is not None and self.shard_by_channel:
+            shards = [self._shards[name] for name in [str(channel_id)] if name in self._shards]
+        else:
+            shards = list(self._shards.values())
+        # 追加や書き出しと同じスレッドで内容を取り出してから、行列計算はイベントループを止めないよう別スレッドで行う
+        snapshots = [shard.snapshot() for shard in shards]
+        return await asyncio.to_thread(self._search, snapshots, vector, k, channel_id)
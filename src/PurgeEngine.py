@@ -0,0 +1,216 @@
+import asyncio
+import datetime
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+import discord
+
+from src.RateLimit import TokenBucket, backoff_delay
+
+BULK_DELETE_LIMIT = 100  # delete_messages で一度に削除できる件数
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14)  # 一括削除できるのは14日以内のメッセージだけ
+HISTORY_PAGE_SIZE = 100
+
+
+@dataclass
+class PurgeProgress:
+    total_channels: int
+    done_channels: int = 0
+    scanned: int = 0
+    deleted: int = 0
+    failed: int = 0
+    missing: int = 0  # すでに削除されていた件数
+    rate_limited: int = 0
+    reserved: int = 0  # 削除対象として確保した件数（上限を超えないように使う）
+    active: set[str] = field(default_factory=set)
+    error_channels: list[str] = field(default_factory=list)
+    elapsed: float = 0.0
+
+
+class PurgeEngine:
+    """Deletes one user's messages across many channels concurrently under a shared request budget
+
+    Every Discord request (history page, delete, progress edit) takes a token from one bucket,
+    so total time depends on the request budget rather than on the number of channels. A 429
+    drains the bucket for its retry_after instead of sleeping a fixed amount.
+    """
+
+    def __init__(self, logger, requests_per_second: float = 10.0, concurrency: int = 4,
+                 progress_interval: float = 5.0, max_attempts: int = 5) -> None:
+        self.logger = logger
+        self.bucket = TokenBucket(requests_per_second, capacity=max(1.0, requests_per_second))
+        self.concurrency = concurrency
+        self.progress_interval = progress_interval
+        self.max_attempts = max_attempts
+
+    async def _call(self, progress: PurgeProgress, fn, *args) -> bool:
+        """Run one request within the budget, retrying 429s and server errors; False if it failed
+
+        discord.NotFound is passed to the caller, which treats the message as already deleted.
+        """
+        for attempt in range(self.max_attempts):
+            await self.bucket.acquire()
+            try:
+                await fn(*args)
+                return True
+            except discord.NotFound:
+                raise
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    progress.rate_limited += 1
+                    self.bucket.penalize(getattr(e, "retry_after", None) or backoff_delay(attempt))
+                elif e.status >= 500:
+                    await asyncio.sleep(backoff_delay(attempt))
+                else:
+                    self.logger.error(f"Error deleting messages: {e}")
+                    return False
+        return False
+
+    async def delete(self, channel, messages: list[discord.abc.Snowflake], progress: PurgeProgress) -> None:
+        """Bulk-delete messages newer than 14 days in chunks of 100 and delete older ones one by one"""
+        cutoff = discord.utils.utcnow() - BULK_DELETE_MAX_AGE
+        recent = [m for m in messages if m.created_at > cutoff]
+        old = [m for m in messages if m.created_at <= cutoff]
+
+        for i in range(0, len(recent), BULK_DELETE_LIMIT):
+            chunk = recent[i:i + BULK_DELETE_LIMIT]
+            if len(chunk) == 1:
+                old += chunk
+                continue
+            try:
+                deleted = await self._call(progress, channel.delete_messages, chunk)
+            except discord.NotFound:
+                deleted = False
+            if deleted:
+                progress.deleted += len(chunk)
+            else:
+                # 一括削除に失敗した場合は1件ずつ削除する
+                old += chunk
+
+        for message in old:
+            try:
+                if await self._call(progress, message.delete):
+                    progress.deleted += 1
+                else:
+                    progress.failed += 1
+            except discord.NotFound:
+                # すでに削除されている（インデックスに残っていた行など）
+                progress.missing += 1
+
+    @staticmethod
+    def _take(batch: list, limit: Optional[int], progress: PurgeProgress) -> list:
+        """The part of the batch that still fits under the limit"""
+        if limit is not None:
+            batch = batch[:max(0, limit - progress.reserved)]
+        progress.reserved += len(batch)
+        return batch
+
+    def _limit_reached(self, limit: Optional[int], progress: PurgeProgress) -> bool:
+        return limit is not None and progress.reserved >= limit
+
+    async def _purge_channel(self, channel, user_id: int, limit: Optional[int], progress: PurgeProgress) -> None:
+        if not channel.permissions_for(channel.guild.me).manage_messages:
+            progress.error_channels.append(f"{channel.name} (権限不足)")
+            progress.done_channels += 1
+            return
+        progress.active.add(channel.name)
+        try:
+            batch = []
+            scanned = 0
+            await self.bucket.acquire()
+            async for message in channel.history(limit=None):
+                scanned += 1
+                progress.scanned += 1
+                if scanned % HISTORY_PAGE_SIZE == 0:
+                    # 次のページを取得する前にトークンを取る
+                    await self.bucket.acquire()
+                if message.author.id != user_id:
+                    continue
+                batch.append(message)
+                if len(batch) >= BULK_DELETE_LIMIT:
+                    await self.delete(channel, self._take(batch, limit, progress), progress)
+                    batch = []
+                    if self._limit_reached(limit, progress):
+                        return
+            if batch:
+                await self.delete(channel, self._take(batch, limit, progress), progress)
+        except discord.Forbidden:
+            progress.error_channels.append(f"{channel.name} (権限不足)")
+        except Exception as e:
+            self.logger.error(f"Error purging messages in {channel.name}: {e}")
+            progress.error_channels.append(f"{channel.name} (エラー: {str(e)})")
+        finally:
+            progress.active.discard(channel.name)
+            progress.done_channels += 1
+
+    async def _report(self, progress: PurgeProgress, started: float,
+                      on_progress: Callable[[PurgeProgress], Awaitable[None]]) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            progress.elapsed = time.monotonic() - started
+            await self.bucket.acquire()
+            try:
+                await on_progress(progress)
+            except discord.HTTPException as e:
+                self.logger.warning(f"Failed to update purge progress: {e}")
+
+    async def _run_all(self, jobs: list, limit: Optional[int], progress: PurgeProgress,
+                       on_progress: Optional[Callable[[PurgeProgress], Awaitable[None]]]) -> PurgeProgress:
+        started = time.monotonic()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_job(job):
+            async with semaphore:
+                if not self._limit_reached(limit, progress):
+                    await job
+                else:
+                    job.close()
+                    progress.done_channels += 1
+
+        reporter = asyncio.create_task(self._report(progress, started, on_progress)) if on_progress else None
+        try:
+            await asyncio.gather(*(run_job(job) for job in jobs))
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+        progress.elapsed = time.monotonic() - started
+        return progress
+
+    async def run(self, channels: list, user_id: int, limit: Optional[int] = None,
+                  on_progress: Optional[Callable[[PurgeProgress], Awaitable[None]]] = None) -> PurgeProgress:
+        """Scan the channels concurrently and delete the user's messages, at most `limit` of them"""
+        limit = limit if limit and limit > 0 else None
+        progress = PurgeProgress(total_channels=len(channels))
+        jobs = [self._purge_channel(channel, user_id, limit, progress) for channel in channels]
+        return await self._run_all(jobs, limit, progress, on_progress)
+
+    async def _delete_in_channel(self, channel, msg_ids: list[int], limit: Optional[int],
+                                 progress: PurgeProgress) -> None:
+        if not channel.permissions_for(channel.guild.me).manage_messages:
+            progress.error_channels.append(f"{channel.name} (権限不足)")
+            progress.done_channels += 1
+            return
+        progress.active.add(channel.name)
+        try:
+            for i in range(0, len(msg_ids), BULK_DELETE_LIMIT):
+                messages = [channel.get_partial_message(msg_id) for msg_id in msg_ids[i:i + BULK_DELETE_LIMIT]]
+                await self.delete(channel, self._take(messages, limit, progress), progress)
+                if self._limit_reached(limit, progress):
+                    return
+        except discord.Forbidden:
+            progress.error_channels.append(f"{channel.name} (権限不足)")
+        except Exception as e:
+            self.logger.error(f"Error purging messages in {channel.name}: {e}")
+            progress.error_channels.append(f"{channel.name} (エラー: {str(e)})")
+        finally:
+            progress.active.discard(channel.name)
+            progress.done_channels += 1
+
+    async def delete_targets(self, targets: list[tuple[object, list[int]]], limit: Optional[int] = None,
+                             on_progress: Optional[Callable[[PurgeProgress], Awaitable[None]]] = None) -> PurgeProgress:
+        """Delete known message IDs, given as (channel, msg_ids) pairs, without scanning history"""
+        limit = limit if limit and limit > 0 else None
+        progress = PurgeProgress(total_channels=len(targets))
+        jobs = [self._delete_in_channel(channel, msg_ids, limit, progress) for channel, msg_ids in targets]
+        return await self._run_all(jobs, limit, progress, on_progress)
@@ -0,0 +1,165 @@
+import asyncio
+import time
+from contextlib import nullcontext
+from typing import AsyncContextManager, Awaitable, Callable, Optional, TypeVar
+
+from src.RateLimit import TokenBucket, backoff_delay
+
+T = TypeVar('T')
+
+RETRYABLE_STATUS = {429, 500, 503}
+
+
+class LLMUnavailable(Exception):
+    """Raised when the circuit is open or upstream kept failing after all retries"""
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    # google.api_core の例外は HTTP ステータスを code 属性に持つ
+    code = getattr(error, 'code', None)
+    if code is None or callable(code):
+        return None
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    return error_status(error) in RETRYABLE_STATUS
+
+
+class CircuitBreaker:
+    """Opens after consecutive upstream failures and lets a single probe through after the reset timeout
+
+    A probe that never reports back (cancelled, or its stream closed early) counts as failed once
+    probe_timeout passes, so the breaker can't stay half-open forever.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0, probe_timeout: float = 180.0,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+
+    def allow(self) -> bool:
+        if self.state == self.HALF_OPEN and self.clock() - self.probe_started >= self.probe_timeout:
+            # 試行の結果が返ってこないので失敗とみなす
+            self._open()
+        if self.state == self.OPEN:
+            if self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self.probe_started = self.clock()
+            return True
+        # 半開状態では試行中の1件以外は通さない
+        return self.state == self.CLOSED
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self._open()
+
+    def record_abandoned(self) -> None:
+        """The call ended without a result (cancelled or closed early); a half-open probe counts as failed"""
+        if self.state == self.HALF_OPEN:
+            self._open()
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self.opened_at = self.clock()
+
+
+class QuotaGovernor:
+    """Client-side requests-per-minute and tokens-per-minute limits with retry backoff and a circuit breaker"""
+
+    def __init__(self, requests_per_minute: int = 15, tokens_per_minute: int = 1_000_000, max_attempts: int = 4,
+                 breaker: Optional[CircuitBreaker] = None, backoff_base: float = 1.0, backoff_cap: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.requests = TokenBucket(requests_per_minute / 60, requests_per_minute, clock=clock)
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute, clock=clock)
+        self.max_attempts = max_attempts
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.throttled = 0
+        self.rejected = 0
+
+    def check(self) -> None:
+        """Fail fast while the circuit is open"""
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise LLMUnavailable("Gemini is temporarily unavailable")
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """Wait for request and token quota"""
+        await self.requests.acquire(1)
+        await self.tokens.acquire(tokens)
+
+    def record(self, error: Optional[BaseException] = None) -> None:
+        if error is None:
+            self.breaker.record_success()
+        elif is_retryable(error) or isinstance(error, asyncio.TimeoutError):
+            self.throttled += 1
+            self.breaker.record_failure()
+        else:
+            # 上流は応答しているので回路は閉じる
+            self.breaker.record_success()
+
+    async def backoff(self, attempt: int) -> None:
+        await asyncio.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+
+    async def call(self, fn: Callable[[], Awaitable[T]], tokens: int = 0,
+                   slot: Optional[Callable[[], AsyncContextManager]] = None) -> T:
+        """Call fn under the quota, retrying 429/5xx with jittered exponential backoff
+
+        Quota is waited for inside `slot` (e.g. a scheduler slot), so when quota is the bottleneck
+        it is still granted in the slot's order rather than in arrival order.
+        """
+        for attempt in range(self.max_attempts):
+            self.check()
+            called = False
+            try:
+                async with (slot() if slot is not None else nullcontext()):
+                    await self.acquire(tokens)
+                    called = True
+                    result = await fn()
+            except Exception as e:
+                if not called:
+                    # 実行枠を得られなかった（キューが満杯など）ので上流の状態は分からない
+                    self.breaker.record_abandoned()
+                    raise
+                self.record(e)
+                if not is_retryable(e):
+                    raise
+                if attempt == self.max_attempts - 1:
+                    raise LLMUnavailable("Gemini kept failing after retries") from e
+                await self.backoff(attempt)
+                continue
+            except BaseException:
+                # キャンセルされた試行も記録しないと半開状態のまま止まる
+                self.breaker.record_abandoned()
+                raise
+            self.record()
+            return result
+        raise LLMUnavailable("Gemini kept failing after retries")
+
+    def stats(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+        }
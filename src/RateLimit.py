@@ -0,0 +1,46 @@
+import asyncio
+import random
+import time
+from typing import Callable
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """Exponential backoff with full jitter for the given zero-based attempt"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    """Async token bucket refilled continuously at `rate` tokens per second"""
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float = 1.0) -> float:
+        """Seconds until `amount` tokens are available"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            wait = self.delay(amount)
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self.delay(amount)
+            self.tokens -= amount
+
+    def penalize(self, seconds: float) -> None:
+        """Drain the bucket so nothing is granted for `seconds` (e.g. after a 429's retry_after)"""
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from src.StateStore import StateStore
+
+
+class ReactionTracker:
+    """Remembers which (message, emoji) pairs were already forwarded and counts reactions in memory
+
+    The forwarded set is persisted so a restart doesn't forward the same post twice. claim() checks
+    and marks in one step without awaiting, so two reactions arriving together can't both win.
+    Changes are written at most once per `flush_delay` seconds, in a worker thread.
+    """
+
+    def __init__(self, store: StateStore, logger, max_forwarded: int = 20_000, max_counters: int = 10_000,
+                 flush_delay: float = 2.0) -> None:
+        self.store = store
+        self.logger = logger
+        self.max_forwarded = max_forwarded
+        self.max_counters = max_counters
+        self.flush_delay = flush_delay
+        self._version = 0  # 変更のたびに増やし、古い内容で新しい内容を上書きしないようにする
+        self._saved_version = 0
+        self._save_lock = threading.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        # 挿入順を保つため dict を集合として使う（古いものから捨てる）
+        self._forwarded: dict[tuple[int, str], None] = {
+            (msg_id, emoji): None for msg_id, emoji in store.load(default=[])
+        }
+        self._counts: OrderedDict[tuple[int, str], int] = OrderedDict()
+
+    def added(self, message_id: int, emoji: str) -> int:
+        key = (message_id, emoji)
+        count = self._counts.get(key, 0) + 1
+        self._counts[key] = count
+        self._counts.move_to_end(key)
+        while len(self._counts) > self.max_counters:
+            self._counts.popitem(last=False)
+        return count
+
+    def removed(self, message_id: int, emoji: str) -> int:
+        key = (message_id, emoji)
+        count = self._counts.get(key)
+        if count is None:
+            return 0
+        if count <= 1:
+            del self._counts[key]
+            return 0
+        self._counts[key] = count - 1
+        return count - 1
+
+    def count(self, message_id: int, emoji: str) -> int:
+        return self._counts.get((message_id, emoji), 0)
+
+    def is_forwarded(self, message_id: int, emoji: str) -> bool:
+        return (message_id, emoji) in self._forwarded
+
+    def claim(self, message_id: int, emoji: str) -> bool:
+        """Mark the pair as forwarded; False if it already was"""
+        key = (message_id, emoji)
+        if key in self._forwarded:
+            return False
+        self._forwarded[key] = None
+        while len(self._forwarded) > self.max_forwarded:
+            del self._forwarded[next(iter(self._forwarded))]
+        self._mark_dirty()
+        return True
+
+    def release(self, message_id: int, emoji: str) -> None:
+        """Undo claim() when the post was not forwarded"""
+        key = (message_id, emoji)
+        if key in self._forwarded:
+            del self._forwarded[key]
+            self._mark_dirty()
+
+    def _mark_dirty(self) -> None:
+        self._version += 1
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    def _save(self, version: int, state: list[list]) -> None:
+        with self._save_lock:
+            if version > self._saved_version:
+                self.store.save(state)
+                self._saved_version = version
+
+    async def _flush_later(self) -> None:
+        # リアクションが続けて付いても、書き込みはまとめて別スレッドで行いイベントループを止めない
+        while self._saved_version < self._version:
+            await asyncio.sleep(self.flush_delay)
+            try:
+                await asyncio.to_thread(self._save, self._version, [list(key) for key in self._forwarded])
+            except OSError as e:
+                self.logger.error(f"Failed to save forwarded reactions: {e}")
+                return
+
+    def close(self) -> None:
+        """Write pending changes now (on shutdown)"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        self._save(self._version, [list(key) for key in self._forwarded])
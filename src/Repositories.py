@@ -1,7 +1,9 @@
 import uuid
-from typing import TypeVar, Generic, Any, Sequence
+from datetime import datetime
+from typing import TypeVar, Generic, Any, AsyncIterator, Optional, Sequence
 
-from sqlalchemy import select, Row, RowMapping
+from sqlalchemy import delete, insert, select, tuple_, update, Row, RowMapping, Select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.Entities import BaseEntity
@@ -21,9 +23,70 @@ class DatabaseRepository(Generic[Model]):
         await self.session.refresh(instance)
         return instance
 
+    async def create_many(self, rows: list[dict]) -> None:
+        """Bulk INSERT in one executemany round trip; instances are not refreshed"""
+        if not rows:
+            return
+        await self.session.execute(insert(self.model), rows)
+        await self.session.commit()
+
+    async def upsert_many(self, rows: list[dict], index_elements: Sequence[str],
+                          update_columns: Optional[Sequence[str]] = None) -> None:
+        """Bulk INSERT ... ON CONFLICT (PostgreSQL); conflicting rows are skipped unless update_columns is given"""
+        if not rows:
+            return
+        statement = pg_insert(self.model)
+        if update_columns:
+            statement = statement.on_conflict_do_update(
+                index_elements=index_elements,
+                set_={column: statement.excluded[column] for column in update_columns},
+            )
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=index_elements)
+        await self.session.execute(statement, rows)
+        await self.session.commit()
+
     async def get(self, pk: uuid.UUID) -> Model | None:
         return await self.session.get(self.model, pk)
 
     async def get_all(self) -> Sequence[Row[Model] | RowMapping | Model]:
         result = await self.session.execute(select(self.model))
         return result.scalars().all()
+
+    async def update_many(self, rows: list[dict]) -> None:
+        """Bulk UPDATE by primary key; each dict must contain `pk`"""
+        if not rows:
+            return
+        await self.session.execute(update(self.model), rows)
+        await self.session.commit()
+
+    async def delete_many(self, column: str, values: Sequence[Any]) -> int:
+        """DELETE rows whose `column` is in `values`; returns the number of deleted rows"""
+        if not values:
+            return 0
+        result = await self.session.execute(delete(self.model).where(getattr(self.model, column).in_(values)))
+        await self.session.commit()
+        return result.rowcount
+
+    def _ordered(self, filters: dict[str, Any], newest_first: bool = False) -> Select:
+        query = select(self.model).filter_by(**filters)
+        if newest_first:
+            return query.order_by(self.model.created_at.desc(), self.model.pk.desc())
+        return query.order_by(self.model.created_at, self.model.pk)
+
+    async def list(self, limit: int = 100, after: Optional[tuple[datetime, uuid.UUID]] = None,
+                   newest_first: bool = False, **filters: Any) -> Sequence[Model]:
+        """One keyset page ordered by (created_at, pk); pass the last row's (created_at, pk) as `after` for the next"""
+        query = self._ordered(filters, newest_first)
+        if after is not None:
+            key = tuple_(self.model.created_at, self.model.pk)
+            query = query.where(key < after if newest_first else key > after)
+        result = await self.session.execute(query.limit(limit))
+        return result.scalars().all()
+
+    async def stream(self, batch_size: int = 1000, **filters: Any) -> AsyncIterator[Model]:
+        """Iterate over matching rows through a server-side cursor, `batch_size` rows in memory at a time"""
+        query = self._ordered(filters).execution_options(yield_per=batch_size)
+        result = await self.session.stream_scalars(query)
+        async for row in result:
+            yield row
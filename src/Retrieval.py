@@ -0,0 +1,65 @@
+import asyncio
+import time
+from typing import Container, Optional
+
+from src.Embeddings import Embedder
+from src.LLMScheduler import Priority
+from src.VectorIndex import VectorIndex
+
+
+class Retriever:
+    """Pulls semantically related saved messages into the prompt within a latency budget"""
+
+    def __init__(self, bot, embedder: Embedder, index: VectorIndex, logger, k: int = 5, budget: float = 0.8,
+                 min_score: float = 0.5, scope: str = "channel") -> None:
+        self.bot = bot
+        self.embedder = embedder
+        self.index = index
+        self.logger = logger
+        self.k = k
+        self.budget = budget
+        self.min_score = min_score
+        self.scope = scope
+        self.calls = 0
+        self.fallbacks = 0
+        self.total_latency = 0.0
+
+    async def related(self, query: str, channel, exclude_ids: Container[int] = ()) -> list[str]:
+        """Related earlier messages as "name: content" lines; empty (recency-only context) if over budget"""
+        if not query:
+            return []
+        started = time.monotonic()
+        self.calls += 1
+        try:
+            return await asyncio.wait_for(self._related(query, channel, exclude_ids), self.budget)
+        except asyncio.TimeoutError:
+            self.fallbacks += 1
+            self.logger.info(f"Retrieval exceeded its {self.budget:.2f}s budget, using recent messages only")
+            return []
+        except Exception as e:
+            self.fallbacks += 1
+            self.logger.error(f"Error in retrieval: {e}")
+            return []
+        finally:
+            self.total_latency += time.monotonic() - started
+
+    async def _related(self, query: str, channel, exclude_ids: Container[int]) -> list[str]:
+        # 返信を待っているユーザーがいるので、埋め込みのバックフィルより先に処理する
+        [vector] = await self.embedder.embed([query], priority=Priority.INTERACTIVE)
+        channel_id = self._scope_channel_id(channel)
+        hits = await self.index.search(vector, self.k, channel_id=channel_id)
+        hits = [hit for hit in hits if hit.score >= self.min_score and hit.msg_id not in exclude_ids]
+        resolved = await self.bot.message_resolver.resolve((hit.channel_id, hit.msg_id) for hit in hits)
+        messages = [resolved[hit.msg_id] for hit in hits if hit.msg_id in resolved]
+        return [f"{message.author_name}: {message.content}" for message in messages if message.content]
+
+    def _scope_channel_id(self, channel) -> Optional[int]:
+        # "guild" ではサーバー全体、"channel" では同じチャンネルの保存メッセージだけを対象にする
+        return None if self.scope == "guild" else channel.id
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "fallbacks": self.fallbacks,
+            "avg_latency": self.total_latency / self.calls if self.calls else 0.0,
+        }
@@ -0,0 +1,127 @@
+import random
+from collections import defaultdict
+from typing import Iterable, Optional
+
+import discord
+
+
+class _IndexedSet:
+    """Set of IDs with O(1) add, remove and uniform random choice"""
+
+    def __init__(self) -> None:
+        self._items: list[int] = []
+        self._positions: dict[int, int] = {}
+
+    def add(self, item: int) -> None:
+        if item not in self._positions:
+            self._positions[item] = len(self._items)
+            self._items.append(item)
+
+    def discard(self, item: int) -> None:
+        position = self._positions.pop(item, None)
+        if position is None:
+            return
+        # 末尾の要素を空いた位置に移して削除を O(1) にする
+        last = self._items.pop()
+        if position < len(self._items):
+            self._items[position] = last
+            self._positions[last] = position
+
+    def choice(self) -> Optional[int]:
+        return random.choice(self._items) if self._items else None
+
+    def __contains__(self, item: int) -> bool:
+        return item in self._positions
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+
+class RoleIndex:
+    """Role ID -> member IDs of non-bot members, kept current from member events"""
+
+    def __init__(self) -> None:
+        self._members_by_role: dict[int, _IndexedSet] = defaultdict(_IndexedSet)
+        self._roles_by_member: dict[int, frozenset[int]] = {}
+
+    def rebuild(self, members: Iterable[discord.Member]) -> None:
+        self._members_by_role.clear()
+        self._roles_by_member.clear()
+        for member in members:
+            self.add_member(member)
+
+    def add_member(self, member: discord.Member) -> None:
+        if member.bot:
+            return
+        self.remove_member(member.id)
+        role_ids = frozenset(role.id for role in member.roles)
+        self._roles_by_member[member.id] = role_ids
+        for role_id in role_ids:
+            self._members_by_role[role_id].add(member.id)
+
+    def remove_member(self, member_id: int) -> None:
+        for role_id in self._roles_by_member.pop(member_id, ()):
+            self._members_by_role[role_id].discard(member_id)
+
+    def update_member(self, before: discord.Member, after: discord.Member) -> None:
+        if after.bot:
+            return
+        old = self._roles_by_member.get(after.id, frozenset())
+        new = frozenset(role.id for role in after.roles)
+        if old == new and after.id in self._roles_by_member:
+            return
+        for role_id in old - new:
+            self._members_by_role[role_id].discard(after.id)
+        for role_id in new - old:
+            self._members_by_role[role_id].add(after.id)
+        self._roles_by_member[after.id] = new
+
+    def to_state(self) -> dict[str, list[int]]:
+        return {str(member_id): sorted(role_ids) for member_id, role_ids in self._roles_by_member.items()}
+
+    def load_state(self, state: dict[str, list[int]]) -> None:
+        """Restore from to_state() output, e.g. a snapshot saved by the previous run"""
+        self._members_by_role.clear()
+        self._roles_by_member.clear()
+        for member_id, role_ids in state.items():
+            member_id = int(member_id)
+            self._roles_by_member[member_id] = frozenset(role_ids)
+            for role_id in role_ids:
+                self._members_by_role[role_id].add(member_id)
+
+    def __len__(self) -> int:
+        return len(self._roles_by_member)
+
+    def count(self, role_id: int) -> int:
+        members = self._members_by_role.get(role_id)
+        return len(members) if members is not None else 0
+
+    def has_role(self, member_id: int, role_id: int) -> bool:
+        return role_id in self._roles_by_member.get(member_id, ())
+
+    def member_ids(self, role_id: int) -> list[int]:
+        members = self._members_by_role.get(role_id)
+        return list(members) if members is not None else []
+
+    async def random_member(self, guild: discord.Guild, role_name: str) -> Optional[discord.Member]:
+        """A random non-bot member with the named role, or None"""
+        role = discord.utils.get(guild.roles, name=role_name)
+        if role is None:
+            return None
+        members = self._members_by_role.get(role.id)
+        if members is None:
+            return None
+        while len(members):
+            member_id = members.choice()
+            member = guild.get_member(member_id)
+            if member is not None:
+                return member
+            # メンバー一覧の取得前（スナップショットから復元した直後）はAPIで取得する
+            try:
+                return await guild.fetch_member(member_id)
+            except discord.NotFound:
+                self.remove_member(member_id)
+        return None
@@ -1,18 +1,81 @@
+import time
+from collections import deque
 from collections.abc import AsyncGenerator
+from typing import Optional
 
 from sqlalchemy import exc
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 
 from Config import settings
 
+# プロセス全体で1つのエンジン（コネクションプール）を使い回す
+_engine: Optional[AsyncEngine] = None
+_session_factory: Optional[async_sessionmaker[AsyncSession]] = None
+_checkout_latencies: deque[float] = deque(maxlen=256)
+_checkouts = 0
+
+
+def get_engine() -> AsyncEngine:
+    """The shared engine, created on first use"""
+    global _engine, _session_factory
+    if _engine is None:
+        _engine = create_async_engine(
+            settings.get_db_url(),
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_pre_ping=settings.DB_POOL_PRE_PING,
+        )
+        _session_factory = async_sessionmaker(_engine, expire_on_commit=False)
+    return _engine
+
+
+async def dispose_engine() -> None:
+    """Close every pooled connection; the next get_engine() creates a new engine"""
+    global _engine, _session_factory
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
+        _session_factory = None
+
 
 async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
-    engine = create_async_engine(settings.get_db_url())
-    factory = async_sessionmaker(engine)
-    async with factory() as session:
+    global _checkouts
+    get_engine()
+    async with _session_factory() as session:
+        # プールから接続を取り出すまでの待ち時間を記録する
+        started = time.monotonic()
+        await session.connection()
+        _checkout_latencies.append(time.monotonic() - started)
+        _checkouts += 1
         try:
             yield session
             await session.commit()
         except exc.SQLAlchemyError as error:
             await session.rollback()
             raise
+
+
+def pool_stats() -> dict:
+    """Pool utilization and recent checkout latency (seconds)"""
+    latencies = sorted(_checkout_latencies)
+    stats = {
+        "checkouts": _checkouts,
+        "avg_checkout": sum(latencies) / len(latencies) if latencies else 0.0,
+        "p95_checkout": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0,
+        "size": 0,
+        "checked_out": 0,
+        "overflow": 0,
+        "utilization": 0.0,
+    }
+    if _engine is not None:
+        pool = _engine.pool
+        capacity = settings.DB_POOL_SIZE + max(settings.DB_MAX_OVERFLOW, 0)
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+            utilization=pool.checkedout() / capacity if capacity else 0.0,
+        )
+    return stats
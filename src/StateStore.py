@@ -0,0 +1,31 @@
+import json
+import os
+from pathlib import Path
+from typing import Any
+
+
+class StateStore:
+    """Small JSON file store for checkpoints and snapshots, written atomically"""
+
+    def __init__(self, directory: str, name: str) -> None:
+        self.path = Path(directory) / f"{name}.json"
+
+    def load(self, default: Any = None) -> Any:
+        try:
+            with self.path.open(encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+        except json.JSONDecodeError:
+            # 壊れたファイルは無視して最初からやり直す
+            return default
+
+    def save(self, value: Any) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def clear(self) -> None:
+        self.path.unlink(missing_ok=True)
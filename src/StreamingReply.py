@@ -0,0 +1,64 @@
+import time
+from typing import Awaitable, Callable, Optional
+
+import discord
+
+MESSAGE_LIMIT = 2000
+
+
+class StreamingReply:
+    """Posts a placeholder reply and edits it as response chunks arrive, rolling over at the message limit"""
+
+    def __init__(self, post: Callable[[str], Awaitable[discord.Message]],
+                 send_more: Callable[[str], Awaitable[discord.Message]],
+                 edit_interval: float = 1.0, placeholder: str = "💭 ...", empty_reply: str = "") -> None:
+        self.post = post
+        self.send_more = send_more
+        self.edit_interval = edit_interval
+        self.placeholder = placeholder
+        self.empty_reply = empty_reply  # 応答にテキストが含まれなかった場合に表示する内容
+        self.message: Optional[discord.Message] = None
+        self.text = ""  # 現在のメッセージに表示する内容
+        self.total_length = 0
+        self._shown = ""
+        self._last_edit = 0.0
+
+    async def start(self) -> None:
+        self.message = await self.post(self.placeholder)
+        self._shown = self.placeholder
+        # 最初のチャンクは待たずにすぐ表示する
+        self._last_edit = 0.0
+
+    async def feed(self, chunk: str) -> None:
+        self.text += chunk
+        self.total_length += len(chunk)
+        while len(self.text) > MESSAGE_LIMIT:
+            split = self.text.rfind("\n", 0, MESSAGE_LIMIT)
+            if split <= 0:
+                split = MESSAGE_LIMIT
+            head, self.text = self.text[:split], self.text[split:].lstrip("\n")
+            await self._edit(head)
+            self.message = await self.send_more(self.placeholder)
+            self._shown = self.placeholder
+        if time.monotonic() - self._last_edit >= self.edit_interval:
+            await self._edit(self.text)
+
+    async def finish(self, suffix: str = "") -> None:
+        text = self.text + suffix
+        if len(text) > MESSAGE_LIMIT:
+            text = self.text
+        if not text:
+            if self.total_length:
+                # 区切りの後に何も続かなかったので、追加したプレースホルダーを消す
+                await self.message.delete()
+                return
+            # ブロックされた応答などでテキストがなければ、プレースホルダーを残さずエラーを表示する
+            text = self.empty_reply
+        await self._edit(text or self._shown)
+
+    async def _edit(self, content: str) -> None:
+        if not content or content == self._shown:
+            return
+        await self.message.edit(content=content)
+        self._shown = content
+        self._last_edit = time.monotonic()
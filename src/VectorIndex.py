@@ -0,0 +1,88 @@
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Iterable, Optional, Sequence
+
+from sqlalchemy import select, text
+
+from Config import settings
+from src import Entities, Session
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    channel_id: int
+    msg_id: int
+    score: float  # コサイン類似度（1に近いほど似ている）
+
+
+class VectorIndex(ABC):
+    """Top-k cosine similarity search over stored message embeddings"""
+
+    # 新着メッセージをその場で索引に追加する必要があるか（pgvectorは埋め込みワーカーがDBに書き込む）
+    ingests_live_messages = False
+
+    @abstractmethod
+    async def search(self, vector: Sequence[float], k: int, channel_id: Optional[int] = None) -> list[SearchHit]:
+        ...
+
+    def add(self, items: Iterable[tuple[int, int, Sequence[float]]]) -> None:
+        """Add (channel_id, msg_id, vector) rows; a no-op where vectors live in the message table"""
+
+    def flush(self) -> None:
+        """Persist rows added since the last flush"""
+
+
+class PgVectorIndex(VectorIndex):
+    """Searches message.embedding through its HNSW index in Postgres
+
+    The channel filter is applied to the candidates the HNSW scan returns, so filtered searches
+    widen the scan to `filter_oversample` candidates per requested hit.
+    """
+
+    MAX_EF_SEARCH = 1000  # pgvector の hnsw.ef_search の上限
+
+    def __init__(self, ef_search: int = 40, filter_oversample: int = 40) -> None:
+        self.ef_search = ef_search
+        self.filter_oversample = filter_oversample
+
+    def ef_search_for(self, k: int, filtered: bool) -> int:
+        """hnsw.ef_search to use for a top-k search, with or without the channel filter"""
+        if not filtered:
+            return self.ef_search
+        # 候補の大半は他のチャンネルのものなので、絞り込んだ後にk件残るよう多めに集める
+        return min(self.MAX_EF_SEARCH, max(self.ef_search, k * self.filter_oversample))
+
+    async def search(self, vector: Sequence[float], k: int, channel_id: Optional[int] = None) -> list[SearchHit]:
+        distance = Entities.Message.embedding.cosine_distance(list(vector))
+        query = select(Entities.Message.channel_id, Entities.Message.msg_id, distance.label("distance")) \
+            .where(Entities.Message.embedding.is_not(None))
+        if channel_id is not None:
+            query = query.where(Entities.Message.channel_id == channel_id)
+        query = query.order_by(distance).limit(k)
+
+        ef_search = self.ef_search_for(k, channel_id is not None)
+        async for session in Session.get_db_session():
+            # 検索時の候補数（大きいほど再現率が上がり遅くなる）
+            await session.execute(text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
+            rows = (await session.execute(query)).all()
+            return [SearchHit(row.channel_id, row.msg_id, 1.0 - row.distance) for row in rows]
+        return []
+
+
+def create_vector_index() -> VectorIndex:
+    """Vector index selected by VECTOR_BACKEND ("auto" uses pgvector when a database is configured)"""
+    backend = settings.VECTOR_BACKEND
+    if backend == "auto":
+        backend = "pgvector" if settings.get_db_url() else "numpy"
+    if backend == "numpy":
+        # numpy は組み込みインデックスを使う場合だけ読み込む
+        from src.NumpyVectorIndex import NumpyVectorIndex
+        return NumpyVectorIndex(
+            os.path.join(settings.STATE_DIR, "vectors"),
+            Entities.EMBEDDING_DIM,
+            dtype=settings.VECTOR_DTYPE,
+            shard_by_channel=settings.VECTOR_SHARD_BY_CHANNEL,
+        )
+    return PgVectorIndex(ef_search=settings.RETRIEVAL_EF_SEARCH,
+                         filter_oversample=settings.RETRIEVAL_FILTER_OVERSAMPLE)
@@ -0,0 +1,102 @@
+import asyncio
+from typing import Optional
+
+from src import Entities, Session
+from src.Models import MessagePayload
+from src.RateLimit import backoff_delay
+from src.Repositories import DatabaseRepository
+
+
+class WriteBehindBuffer:
+    """Queues MessagePayload rows and writes them in batches, one transaction per batch
+
+    A batch is written once it reaches `max_batch` rows or `flush_interval` seconds after its
+    first row. put() waits while `max_pending` rows are queued, so a slow database slows
+    producers down instead of growing memory without bound.
+    """
+
+    def __init__(self, logger, max_batch: int = 500, flush_interval: float = 2.0, max_pending: int = 10_000,
+                 max_attempts: int = 3) -> None:
+        self.logger = logger
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self._queue: asyncio.Queue[MessagePayload] = asyncio.Queue(maxsize=max_pending)
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def put(self, payload: MessagePayload) -> None:
+        """Queue a row; waits when the buffer is full"""
+        await self._queue.put(payload)
+
+    async def _collect(self) -> list[MessagePayload]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write(self, batch: list[MessagePayload]) -> None:
+        rows = [payload.dict() for payload in batch]
+        for attempt in range(self.max_attempts):
+            try:
+                async for session in Session.get_db_session():
+                    repo = DatabaseRepository(Entities.Message, session)
+                    await repo.upsert_many(rows, index_elements=["msg_id"])
+                self.written += len(rows)
+                self.batches += 1
+                return
+            except Exception as e:
+                self.logger.warning(f"Writing {len(rows)} messages failed (attempt {attempt + 1}): {e}")
+                if attempt + 1 < self.max_attempts:
+                    await asyncio.sleep(backoff_delay(attempt))
+        self.dropped += len(rows)
+        self.logger.error(f"Dropped {len(rows)} messages after {self.max_attempts} attempts")
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Flush everything queued (waiting at most `timeout` seconds) and stop the writer"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            self.logger.error(f"Shutting down with {self._queue.qsize()} unsaved messages")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+        }
@@ -0,0 +1,7 @@
+import os
+
+# Config.settings は読み込み時に必須の設定を要求するので、テスト用の値を入れておく
+for name in ("DISCORD_API_KEY", "OPENAI_API_KEY", "GEMINI_API_KEY", "INITIAL_PROMPT"):
+    os.environ.setdefault(name, "test")
+for name in ("LOG_CHANNEL_ID", "GAKUBUCHI_CHANNEL_ID", "MINNA_BUNKO_CHANNEL_ID", "FREEMEMO_CHANNEL_ID", "GUILD_ID"):
+    os.environ.setdefault(name, "0")
@@ -0,0 +1,53 @@
+import asyncio
+import itertools
+
+from src.ChatSessions import ChatSessionPool
+
+
+def test_waiter_gets_fresh_session_after_discard():
+    async def main():
+        counter = itertools.count(1)
+        pool = ChatSessionPool(lambda: f"chat{next(counter)}")
+        used = []
+        first_holds_lock = asyncio.Event()
+
+        async def timed_out_call():
+            async with pool.session("channel") as session:
+                used.append(session.chat)
+                first_holds_lock.set()
+                await asyncio.sleep(0.01)
+                # タイムアウトしたのでセッションを破棄する（スレッドはまだ履歴に書き込む）
+                pool.discard("channel")
+
+        async def waiting_call():
+            await first_holds_lock.wait()
+            async with pool.session("channel") as session:
+                used.append(session.chat)
+
+        await asyncio.gather(timed_out_call(), waiting_call())
+        assert used == ["chat1", "chat2"]
+
+    asyncio.run(main())
+
+
+def test_clear_closes_sessions_for_waiters():
+    async def main():
+        counter = itertools.count(1)
+        pool = ChatSessionPool(lambda: f"chat{next(counter)}")
+        used = []
+
+        async def holder():
+            async with pool.session("channel") as session:
+                used.append(session.chat)
+                await asyncio.sleep(0.01)
+                pool.clear()
+
+        async def waiter():
+            await asyncio.sleep(0)
+            async with pool.session("channel") as session:
+                used.append(session.chat)
+
+        await asyncio.gather(holder(), waiter())
+        assert used == ["chat1", "chat2"]
+
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+
+from src import EmbeddingWorker as worker_module
+from src import Entities, Session
+from src.EmbeddingWorker import EmbeddingWorker
+from src.Embeddings import HashingEmbedder
+from src.StateStore import StateStore
+
+
+class FakeRepository:
+    """In-memory stand-in for DatabaseRepository with the same keyset paging"""
+
+    def __init__(self, rows: list[Entities.Message]) -> None:
+        self.rows = {row.pk: row for row in rows}
+
+    async def list(self, limit=100, after=None, **filters):
+        rows = sorted(self.rows.values(), key=lambda row: (row.created_at, row.pk))
+        rows = [row for row in rows if all(getattr(row, key) == value for key, value in filters.items())]
+        if after is not None:
+            rows = [row for row in rows if (row.created_at, row.pk) > after]
+        return rows[:limit]
+
+    async def update_many(self, updates):
+        for update in updates:
+            row = self.rows[update["pk"]]
+            for key, value in update.items():
+                setattr(row, key, value)
+
+
+def make_rows(count: int) -> list[Entities.Message]:
+    started = datetime(2024, 1, 1)
+    return [Entities.Message(pk=uuid.uuid4(), member_id=1, channel_id=10, msg_id=i, embedding=None,
+                             embedding_skipped=False, created_at=started + timedelta(seconds=i))
+            for i in range(count)]
+
+
+def make_worker(monkeypatch, tmp_path, rows, contents):
+    repo = FakeRepository(rows)
+
+    async def get_db_session():
+        yield None
+
+    monkeypatch.setattr(Session, "get_db_session", get_db_session)
+    monkeypatch.setattr(worker_module, "DatabaseRepository", lambda model, session: repo)
+    fetched = []
+
+    async def fetch_contents(batch):
+        fetched.extend(row.msg_id for row in batch)
+        return {row.pk: contents[row.msg_id] for row in batch if row.msg_id in contents}
+
+    worker = EmbeddingWorker(HashingEmbedder(dim=16), fetch_contents, logging.getLogger("test"),
+                             StateStore(str(tmp_path), "checkpoint"), batch_size=2)
+    return worker, fetched
+
+
+def test_embeds_and_skips_unembeddable_rows(monkeypatch, tmp_path):
+    rows = make_rows(5)
+    # 0, 1, 3: 本文あり / 2: 削除済み / 4: 今は取得できない
+    contents = {0: "hello", 1: "world", 2: "", 3: "again"}
+    worker, fetched = make_worker(monkeypatch, tmp_path, rows, contents)
+
+    embedded, _ = asyncio.run(worker.run())
+    assert embedded == 3
+    assert [row.embedding is not None for row in rows] == [True, True, False, True, False]
+    assert [row.embedding_skipped for row in rows] == [False, False, True, False, False]
+    assert len(rows[0].embedding) == 16
+
+    # 次の巡回では取得できなかった行だけを読み直し、取得できれば埋め込む
+    fetched.clear()
+    assert asyncio.run(worker.run())[0] == 0
+    assert fetched == [4]
+    contents[4] = "found"
+    fetched.clear()
+    assert asyncio.run(worker.run())[0] == 1
+    assert fetched == [4]
+    assert rows[4].embedding is not None
+
+    # その後はチェックポイントが残るので、同じ行を取得し直さない
+    fetched.clear()
+    assert asyncio.run(worker.run()) == (0, 0.0)
+    assert fetched == []
+
+
+def test_gives_up_on_rows_that_stay_unreadable(monkeypatch, tmp_path):
+    rows = make_rows(3)
+    contents = {0: "hello", 2: "again"}
+    worker, fetched = make_worker(monkeypatch, tmp_path, rows, contents)
+    worker.max_attempts = 2
+
+    assert asyncio.run(worker.run())[0] == 2
+    fetched.clear()
+    asyncio.run(worker.run())
+    assert fetched == [1]
+    assert rows[1].embedding_skipped
+
+    fetched.clear()
+    asyncio.run(worker.run())
+    assert fetched == []
+
+
+def test_rewind_retries_only_pending_rows(monkeypatch, tmp_path):
+    rows = make_rows(4)
+    contents = {0: "hello", 1: ""}
+    worker, fetched = make_worker(monkeypatch, tmp_path, rows, contents)
+    asyncio.run(worker.run())
+
+    contents.update({2: "later", 3: "found"})
+    fetched.clear()
+    worker.rewind()
+    embedded, _ = asyncio.run(worker.run())
+    assert embedded == 2
+    # 埋め込み済みの行と、印を付けた行は読み直さない
+    assert fetched == [2, 3]
+    assert all(row.embedding is not None for row in rows if row.msg_id != 1)
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import threading
+
+import pytest
+
+from src.LLMClient import LLMClient
+from src.LLMScheduler import Priority
+from src.QuotaGovernor import CircuitBreaker, LLMUnavailable, QuotaGovernor
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class UpstreamError(Exception):
+    """Stands in for google.api_core errors, which carry the HTTP status in `code`"""
+
+    def __init__(self, code: int) -> None:
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+class FakeModel:
+    """Fails with the given statuses in order, then returns "ok" """
+
+    def __init__(self, *statuses: int) -> None:
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def generate_content(self, prompt):
+        self.calls += 1
+        if self.statuses:
+            raise UpstreamError(self.statuses.pop(0))
+        return "ok"
+
+
+class FakeChat:
+    """Chat whose streamed reply waits until `release` is set"""
+
+    def __init__(self) -> None:
+        self.history = []
+        self.release = threading.Event()
+
+    def send_message(self, content, stream=False):
+        self.release.wait(5)
+        return iter([])
+
+
+def make_client(model, clock=None, **breaker_options) -> LLMClient:
+    clock = clock or FakeClock()
+    breaker = CircuitBreaker(clock=clock, **{"failure_threshold": 2, "reset_timeout": 60.0, **breaker_options})
+    governor = QuotaGovernor(requests_per_minute=600, max_attempts=3, breaker=breaker, backoff_base=0.0,
+                             clock=clock)
+    return LLMClient(model, logging.getLogger("test"), governor=governor)
+
+
+async def open_breaker(client: LLMClient) -> None:
+    with pytest.raises(LLMUnavailable):
+        await client.generate("hi")
+    assert client.governor.breaker.state == CircuitBreaker.OPEN
+
+
+def test_retries_429_then_succeeds():
+    async def main():
+        model = FakeModel(429, 429)
+        client = make_client(model, failure_threshold=5)
+        assert await client.generate("hi") == "ok"
+        assert model.calls == 3
+        assert client.governor.throttled == 2
+        assert client.governor.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(main())
+
+
+def test_breaker_opens_and_rejects_without_calling():
+    async def main():
+        model = FakeModel(503, 503)
+        client = make_client(model)
+        await open_breaker(client)
+        calls, rejected = model.calls, client.governor.rejected
+        with pytest.raises(LLMUnavailable):
+            await client.generate("hi")
+        assert model.calls == calls
+        assert client.governor.rejected == rejected + 1
+
+    asyncio.run(main())
+
+
+def test_half_open_probe_success_closes():
+    async def main():
+        clock = FakeClock()
+        model = FakeModel(503, 503)
+        client = make_client(model, clock)
+        await open_breaker(client)
+        clock.now += 61
+        assert await client.generate("hi") == "ok"
+        assert client.governor.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(main())
+
+
+def test_half_open_probe_failure_reopens():
+    async def main():
+        clock = FakeClock()
+        model = FakeModel(503, 503, 503)
+        client = make_client(model, clock)
+        await open_breaker(client)
+        clock.now += 61
+        with pytest.raises(LLMUnavailable):
+            await client.generate("hi")
+        assert client.governor.breaker.state == CircuitBreaker.OPEN
+
+    asyncio.run(main())
+
+
+def test_cancelled_half_open_probe_reopens():
+    async def main():
+        clock = FakeClock()
+        client = make_client(FakeModel(503, 503), clock)
+        await open_breaker(client)
+        clock.now += 61
+
+        async def hang():
+            await asyncio.sleep(10)
+
+        probe = asyncio.create_task(client.governor.call(hang))
+        await asyncio.sleep(0)
+        assert client.governor.breaker.state == CircuitBreaker.HALF_OPEN
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert client.governor.breaker.state == CircuitBreaker.OPEN
+
+        # リセット時間が過ぎれば次の試行が通る
+        clock.now += 61
+        assert await client.generate("hi") == "ok"
+        assert client.governor.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(main())
+
+
+def test_cancelled_half_open_stream_probe_reopens():
+    async def main():
+        clock = FakeClock()
+        client = make_client(FakeModel(503, 503, 503), clock)
+        await open_breaker(client)
+        clock.now += 61
+
+        chat = FakeChat()
+
+        async def consume():
+            async for _ in client.stream_message(chat, "hi"):
+                pass
+
+        probe = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        chat.release.set()
+        assert client.governor.breaker.state == CircuitBreaker.OPEN
+
+    asyncio.run(main())
+
+
+def test_silent_half_open_probe_times_out():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60.0, probe_timeout=120.0, clock=clock)
+    breaker.record_failure()
+    clock.now += 61
+    assert breaker.allow()
+    assert not breaker.allow()
+    # 結果が返ってこないまま probe_timeout が過ぎると開いた状態に戻る
+    clock.now += 120
+    assert not breaker.allow()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 61
+    assert breaker.allow()
+
+
+def test_quota_is_granted_in_priority_order():
+    async def main():
+        client = LLMClient(FakeModel(), logging.getLogger("test"), max_concurrency=1,
+                           governor=QuotaGovernor(requests_per_minute=600))
+        client.governor.requests.tokens = 0
+        order = []
+
+        async def job(name, priority):
+            await client.run(order.append, name, priority=priority)
+
+        jobs = [asyncio.create_task(job(f"bg{i}", Priority.BACKGROUND)) for i in range(4)]
+        await asyncio.sleep(0)
+        jobs.append(asyncio.create_task(job("interactive", Priority.INTERACTIVE)))
+        await asyncio.gather(*jobs)
+        assert order.index("interactive") <= 1
+
+    asyncio.run(main())